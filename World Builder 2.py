@@ -5,16 +5,41 @@ from tkinter import ttk
 from PIL import ImageTk, Image
 from os import path
 from os import getcwd
+from os import fsync, listdir, makedirs, remove, replace
+import gzip
 import json
+import lzma
 import re
-from dataclasses import dataclass, field
+import marshal
+import mmap
+import queue
+import struct
+import threading
+import uuid
+import weakref
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, compress, count, groupby, islice, repeat
+from operator import add, eq, le, ne, not_
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
 from typing import List
 
-from sys import platform
+from sys import argv, byteorder, platform
+
+try:
+    import numpy
+except ImportError:
+    # Minimaps are then pasted together tile by tile (see render_minimap)
+    numpy = None
 
 if platform == 'win32':
     from ctypes import windll
+    import msvcrt
     # windll.shcore.SetProcessDpiAwareness(1)
+else:
+    import fcntl
 
 
 class ScrollbarEntry(tk.Frame):
@@ -925,6 +950,9 @@ class CustomScrollbar(ttk.Scrollbar):
 class TilemapEditorWindow(tk.Frame):
     imgs = {}
     ids_data = {}
+    # Bumped whenever ids_data is modified, so that ids.json is only rewritten when needed
+    ids_revision = 0
+    ids_saved_revision = 0
     __initialized = False
 
     class Decorators(object):
@@ -970,6 +998,11 @@ class TilemapEditorWindow(tk.Frame):
         # Create a lookup list of the available views
         self.view_list = []
 
+        # Saves are written on a background thread, and minimaps rendered and encoded on another, so that a level's
+        # file does not wait on its minimap
+        self.save_worker = BackgroundWorker(self)
+        self.minimap_worker = BackgroundWorker(self)
+
         # Add editor to parent window
         parent.add(self, text="Map Editor")
 
@@ -1162,8 +1195,11 @@ class TilemapEditorWindow(tk.Frame):
         self.helpmenu.add_command(label="This menubar cannot help you", command=self.unimplemented)
         self.menubar.add_cascade(label="Help", menu=self.helpmenu)
 
-        # Create initial tilemap view
+        # Create initial tilemap view.  The journals left behind by an earlier session are looked for first, so that
+        # they cannot be mistaken for the new view's.
+        leftovers = Journal.leftovers()
         self.new_view()
+        self.recover_journals(leftovers)
 
     @Decorators.hidden_event
     def _open_map(self):
@@ -1171,7 +1207,12 @@ class TilemapEditorWindow(tk.Frame):
         # Make sure the tilemap editor is actually open
         if self.master.index("current") != 0:
             return
-        file = filedialog.askopenfilename(filetypes=[("Json", "*.json")], defaultextension=[("Json", "*.json")])
+        file = filedialog.askopenfilename(filetypes=[("Level", "*.json *.json.gz *.json.xz *" + Level.binary_extension +
+                                                      " *" + Level.binary_extension + ".gz *" + Level.binary_extension +
+                                                      ".xz"),
+                                                     ("Json", "*.json"), ("Compressed Json", "*.json.gz *.json.xz"),
+                                                     ("Binary Level", "*" + Level.binary_extension)],
+                                          defaultextension=[("Json", "*.json")])
         if file == "" or file is None:
             return
         self.open_map(file)
@@ -1182,6 +1223,55 @@ class TilemapEditorWindow(tk.Frame):
         if not self.view_list[self.tilemap_panel.index("current")].load_from_file(file):
             self._close_view()
 
+    def recover_journals(self, leftovers):
+        """Offer to recover the unsaved work found in journals left behind by an earlier session (as listed by
+        Journal.leftovers)"""
+        journals = []
+        # Journals of levels whose file has since been moved or deleted.  Their edits only make sense on top of it, so
+        # they are left for when it is back.
+        missing = []
+        for file in leftovers:
+            try:
+                base, records, data = Journal.read(file)
+            except OSError:
+                # Gone already (recovered by another instance of the editor, say)
+                continue
+            if not records:
+                # Nothing to recover
+                self._remove_journal(file)
+            elif base is None or path.exists(base):
+                journals.append(file)
+            else:
+                missing.append(base)
+        if missing:
+            messagebox.showwarning("World Builder 2", "Unsaved work was found for levels that are no longer where they "
+                                                      "were saved:\n\n" + "\n".join(missing) + "\n\nIt has been kept, "
+                                                      "and will be offered again once they are back in place.")
+        if not journals:
+            return
+        if not messagebox.askyesno("World Builder 2", "Unsaved work from a previous session was found.  Would you "
+                                                      "like to recover it?"):
+            for file in journals:
+                self._remove_journal(file)
+            return
+        for file in journals:
+            base = Journal.read(file)[0]
+            if base is None:
+                self.new_view()
+            else:
+                self.open_map(base)
+            view = self.view_list[self.tilemap_panel.index("current")]
+            if view.file_path == base:
+                view.recover(file)
+
+    @staticmethod
+    def _remove_journal(file):
+        """Remove a leftover journal, leaving it be if that is not possible (if another process has it open, say)"""
+        try:
+            remove(file)
+        except OSError as e:
+            print("Could not remove journal {}: {}".format(file, e))
+
     @Decorators.hidden_event
     def _save_map(self):
         """Event callback for saving a level"""
@@ -1202,7 +1292,14 @@ class TilemapEditorWindow(tk.Frame):
         input_data = self.view_list[self.tilemap_panel.index("current")].level.default_start
         data = NumberSetDialog(self.master.master, [{"Col": input_data[0], "Row": input_data[1]}]).result
         if data is not None:
+            self.view_list[self.tilemap_panel.index("current")].begin_edit()
             self.view_list[self.tilemap_panel.index("current")].level.default_start = [data[0]["Col"], data[0]["Row"]]
+            self.view_list[self.tilemap_panel.index("current")].backup_state()
+
+    def publish_minimaps(self):
+        """Show the levels being edited, as they are now, in the world editor"""
+        for i in self.view_list:
+            i.publish_minimap()
 
     @Decorators.hidden_event
     def new_view(self):
@@ -1269,6 +1366,7 @@ class TilemapEditorWindow(tk.Frame):
         size_change = NumberSetDialog(self.master.master, [{"Left": 0}, {"Right": 0}, {"Up": 0}, {"Down": 0}]).result
         if size_change is None:
             return
+        self.view_list[index].begin_edit()
         try:
             self.view_list[index].level.change_size(left=int(size_change[0]["Left"]),
                                                     right=int(size_change[1]["Right"]),
@@ -1289,6 +1387,7 @@ class TilemapEditorWindow(tk.Frame):
                                    App.project_data["groups"]["tile"]).result
         if result is not None:
             App.project_data["groups"]["tile"] = result
+            App.mark_project_dirty("groups")
             self.reload_groups()
 
     @Decorators.hidden_event
@@ -1299,6 +1398,7 @@ class TilemapEditorWindow(tk.Frame):
                                    App.project_data["groups"]["deco"]).result
         if result is not None:
             App.project_data["groups"]["deco"] = result
+            App.mark_project_dirty("groups")
             self.reload_groups()
 
     def import_tile(self, mode):
@@ -1344,6 +1444,7 @@ class TilemapEditorWindow(tk.Frame):
             TilemapEditorWindow.ids_data[f'{mode}_ids'][new_id] = {"tex": tile_name, "geo": [0, 0, 0, 0]}
             if mode == 'deco':
                 TilemapEditorWindow.ids_data['deco_ids'][new_id]["height"] = 1
+            TilemapEditorWindow.ids_revision += 1
 
             print(f'Imported {tile_name} from {file_path}')
 
@@ -1357,6 +1458,7 @@ class TilemapEditorWindow(tk.Frame):
             if self.view_list[index].saved and self.view_list[index].file_path is not None:
                 relative_path = self.view_list[index].file_path.replace((getcwd() + '/').replace('\\', '/'), '')
                 App.project_data["levels"][level.name] = {"path": relative_path, "world_pos": level.world_pos}
+                App.mark_project_dirty("levels", level.name)
                 level.ignore_from_project = False
                 messagebox.showinfo("World Builder 2", "Level added to project.")
             else:
@@ -1370,6 +1472,7 @@ class TilemapEditorWindow(tk.Frame):
         level = self.view_list[index].level
         if level.name in App.project_data["levels"]:
             del App.project_data["levels"][level.name]
+            App.mark_project_dirty("levels", level.name)
             level.ignore_from_project = True
             messagebox.showinfo("World Builder 2", "Level removed from project.")
         else:
@@ -1735,6 +1838,40 @@ class TilemapEditorWindow(tk.Frame):
 
         cls.__initialized = True
 
+    @classmethod
+    def save_ids(cls):
+        """Save ids_data to ids.json, if it has been modified since it was last saved"""
+        ids = cls.dump_ids()
+        if ids is not None:
+            cls.write_ids(*ids)
+
+    @classmethod
+    def dump_ids(cls):
+        """Returns (ids.json text, revision) for the current ids_data, or None if ids.json is up to date"""
+        if cls.ids_revision == cls.ids_saved_revision:
+            return None
+
+        # Format the ids data
+        formatted_ids = {}
+        for list_name, id_list in cls.ids_data.items():
+            formatted_ids[list_name] = []
+            for _id, data in id_list.items():
+                formatted_ids[list_name].append({"id": _id, "tex": data["tex"], "geo": data["geo"]})
+                if "height" in data:
+                    formatted_ids[list_name][-1]["height"] = data["height"]
+
+        # Save the id list to the file in a readable format
+        ids_data = json.dumps(formatted_ids, indent=2)
+        ids_data = re.sub(r'\[\s+(\d),\s+(\d),\s+(\d),\s+(\d)\s+\]', r'[\1, \2, \3, \4]', ids_data)
+        return ids_data, cls.ids_revision
+
+    @classmethod
+    def write_ids(cls, ids_data, revision):
+        """Write text from dump_ids to ids.json.  Safe to call from the save worker."""
+        with atomic_write("assets/ids.json") as f:
+            f.write(ids_data)
+        cls.ids_saved_revision = revision
+
 
 class TilemapEditingLayer:
     img_dict = {}
@@ -1827,46 +1964,37 @@ class TilemapLayer(TilemapEditingLayer):
         view.canvas.bind("<ButtonRelease-2>", lambda event: view.draw_line_finish(event, self.draw_individual))
         view.canvas.bind("<Shift-ButtonPress-1>", lambda event: view.generic_flood_fill(event, self.flood_fill))
 
-    def draw_full(self, view, update_minimap=False):
+    def draw_full(self, view):
         """Draw the tilemap to the view"""
-        for i, j in enumerate(view.level.tilemap):
-            for k, m in enumerate(j):
-                if m != 0:
-                    view.canvas.create_image((k * 64 + 32, i * 64 + 32), image=TilemapLayer.img_dict[m])
-                    if update_minimap:
-                        if TilemapLayer.mini_img_dict[m].mode == 'RGBA':
-                            view.image_view.paste(TilemapLayer.mini_img_dict[m], box=(k * 8, i * 8),
-                                                  mask=TilemapLayer.mini_img_dict[m])
-                        else:
-                            view.image_view.paste(TilemapLayer.mini_img_dict[m], box=(k * 8, i * 8))
+        for k, i, m in view.level.tilemap.iter_cells():
+            view.canvas.create_image((k * 64 + 32, i * 64 + 32), image=TilemapLayer.img_dict[m])
 
     def flood_fill(self, view, tile_x, tile_y):
         """Fill the tilemap with the selected tile"""
         # Recursively fill the tile that was clicked on with -1
-        tile_to_replace = view.level.tilemap[tile_y][tile_x]
+        tile_to_replace = view.level.tilemap[tile_x, tile_y]
         self._flood_fill(view.level.tilemap, tile_to_replace, tile_x, tile_y)
 
         # Replace the tiles marked for replacement with the currently selected tile
         current_tile = view.master.master.visible_pane.selected_id.get()
-        for y, i in enumerate(view.level.tilemap):
-            for x, j in enumerate(i):
-                if j == -1:
-                    view.level.tilemap[y][x] = current_tile
+        for x, y, j in list(view.level.tilemap.iter_cells()):
+            if j == -1:
+                view.level.tilemap[x, y] = current_tile
 
     def _flood_fill(self, tilemap, tile_to_replace, tile_x, tile_y):
         """Recursive function to fill the tilemap"""
-        tilemap[tile_y][tile_x] = -1
+        tilemap[tile_x, tile_y] = -1
 
-        if tile_x - 1 >= 0 and tilemap[tile_y][tile_x - 1] == tile_to_replace:
+        if tile_x - 1 >= 0 and tilemap[tile_x - 1, tile_y] == tile_to_replace:
             self._flood_fill(tilemap, tile_to_replace, tile_x - 1, tile_y)
 
-        if tile_x + 1 < len(tilemap[tile_y]) and tilemap[tile_y][tile_x + 1] == tile_to_replace:
+        if tile_x + 1 < tilemap.width and tilemap[tile_x + 1, tile_y] == tile_to_replace:
             self._flood_fill(tilemap, tile_to_replace, tile_x + 1, tile_y)
 
-        if tile_y - 1 >= 0 and tilemap[tile_y - 1][tile_x] == tile_to_replace:
+        if tile_y - 1 >= 0 and tilemap[tile_x, tile_y - 1] == tile_to_replace:
             self._flood_fill(tilemap, tile_to_replace, tile_x, tile_y - 1)
 
-        if tile_y + 1 < len(tilemap) and tilemap[tile_y + 1][tile_x] == tile_to_replace:
+        if tile_y + 1 < tilemap.height and tilemap[tile_x, tile_y + 1] == tile_to_replace:
             self._flood_fill(tilemap, tile_to_replace, tile_x, tile_y + 1)
 
     def draw_individual(self, view, tile_x, tile_y, limited=False):
@@ -1878,7 +2006,7 @@ class TilemapLayer(TilemapEditingLayer):
                                  image=TilemapLayer.img_dict[current_tile])
         # Add the tile to the tilemap matrix
         try:
-            view.level.tilemap[tile_y][tile_x] = int(current_tile)
+            view.level.tilemap[tile_x, tile_y] = int(current_tile)
         except IndexError:
             pass
 
@@ -1900,24 +2028,16 @@ class DecomapLayer(TilemapEditingLayer):
     icon = None
     mini_img_dict = {}
 
-    def draw_full(self, view, update_minimap=False):
+    def draw_full(self, view):
         """Draw the current level's decomap"""
         # Draw decos at the selected height
         selected_z = view.selected_height
 
         view.level.decomap.sort()
-        for deco in view.level.decomap:
-            if selected_z and deco.height != selected_z:
-                continue
+        for deco in view.level.decomap.filter_height(selected_z):
             if deco.deco_id != 0:
                 view.canvas.create_image((deco.x * 64 + 32, deco.y * 64 + 32),
                                          image=DecomapLayer.img_dict[deco.deco_id])
-                if update_minimap:
-                    if DecomapLayer.mini_img_dict[deco.deco_id].mode == 'RGBA':
-                        view.image_view.paste(DecomapLayer.mini_img_dict[deco.deco_id], box=(deco.x * 8, deco.y * 8),
-                                              mask=DecomapLayer.mini_img_dict[deco.deco_id])
-                    else:
-                        view.image_view.paste(DecomapLayer.mini_img_dict[deco.deco_id], box=(deco.x * 8, deco.y * 8))
 
     def draw_individual(self, view, tile_x, tile_y, limited=False):
         current_tile = view.master.master.visible_pane.selected_id.get()
@@ -1975,7 +2095,7 @@ class CollisionLayer(TilemapEditingLayer):
         for i in range(view.level.level_height * 2 + 1):
             view.canvas.create_line(0, 32 * i, 64 * view.level.level_width, 32 * i, fill="BLACK", width=1.0)
         # Draw the collision map
-        for i, j in enumerate(view.level.collider):
+        for i, j in enumerate(view.level.collider.rows()):
             solid_count = 0
             last_k = 0
             # When drawing rows, combine adjacent solids into a single rectangle
@@ -2035,7 +2155,7 @@ class CollisionLayer(TilemapEditingLayer):
                     target_id = view.level.decomap[tile_x // 2, tile_y // 2][-1].deco_id
                 target_set = "deco_ids"
             if not deco_found and selected_z <= 1:
-                target_id = view.level.tilemap[tile_y // 2][tile_x // 2]
+                target_id = view.level.tilemap[tile_x // 2, tile_y // 2]
                 target_set = "tile_ids"
 
             if target_id is None or target_set is None:
@@ -2043,8 +2163,11 @@ class CollisionLayer(TilemapEditingLayer):
                 return
 
             # Modify tile's geometry
-            TilemapEditorWindow.ids_data[target_set][target_id]["geo"][2 * sub_x + sub_y] = solid_state
-            view.level.collider[tile_y][tile_x] = solid_state
+            geometry = TilemapEditorWindow.ids_data[target_set][target_id]["geo"]
+            if geometry[2 * sub_x + sub_y] != solid_state:
+                geometry[2 * sub_x + sub_y] = solid_state
+                TilemapEditorWindow.ids_revision += 1
+            view.level.collider[tile_x, tile_y] = solid_state
         except IndexError:
             pass
 
@@ -2087,9 +2210,7 @@ class HeightLayer(TilemapEditingLayer):
         selected_z = view.selected_height
         color, text_color = (("orange", "Dark Red"), ("green2", "black"))[self.render_mode]  # One liners let's gooo!
 
-        for i in view.level.decomap:
-            if selected_z and selected_z != i.height:
-                continue
+        for i in view.level.decomap.filter_height(selected_z):
             if i.deco_id != 0:
                 # self.canvas.create_image((x * 64 + 32, y * 64 + 32), image=TilemapEditorWindow.imgs["height_blank"])
                 view.canvas.create_rectangle((i.x * 64, i.y * 64, i.x * 64 + 64, i.y * 64 + 64),
@@ -2134,25 +2255,26 @@ class HeightLayer(TilemapEditingLayer):
             for i in decos:
                 if selected_z and selected_z != i.height:
                     continue
-                function(i, height_option)
+                function(view.level.decomap, i, height_option)
 
     @staticmethod
-    def _modify_selected(deco, height_option):
-        deco.height += (1, 5, -1, -5)[height_option]
+    def _modify_selected(decomap, deco, height_option):
+        decomap.update(deco, height=deco.height + (1, 5, -1, -5)[height_option])
 
     @staticmethod
-    def _modify_render_offset(deco, height_option):
-        deco.render_offset += (1, 5, -1, -5)[height_option]
+    def _modify_render_offset(decomap, deco, height_option):
+        decomap.update(deco, render_offset=deco.render_offset + (1, 5, -1, -5)[height_option])
 
     # TODO: Add a better way to modify the default height
     @staticmethod
-    def _modify_default(deco, height_option):
+    def _modify_default(decomap, deco, height_option):
         TilemapEditorWindow.ids_data["deco_ids"][deco.deco_id]["height"] += (1, 5, -1, -5)[height_option]
-        deco.height = TilemapEditorWindow.ids_data["deco_ids"][deco.deco_id]["height"]
+        TilemapEditorWindow.ids_revision += 1
+        decomap.update(deco, height=TilemapEditorWindow.ids_data["deco_ids"][deco.deco_id]["height"])
 
     @staticmethod
-    def _reset_selected(deco, height_option=None):
-        deco.height = TilemapEditorWindow.ids_data["deco_ids"][deco.deco_id]["height"]
+    def _reset_selected(decomap, deco, height_option=None):
+        decomap.update(deco, height=TilemapEditorWindow.ids_data["deco_ids"][deco.deco_id]["height"])
 
     @classmethod
     def _initialize(cls):
@@ -2252,11 +2374,14 @@ class StepLayer(TilemapEditingLayer):
                 view.canvas.create_image(tile_x * 32 + 16, tile_y * 32 + 16,
                                          image=StepLayer.special_imgs[("mini_elevate", "mini_elevate", "mini_descend",
                                                                        "mini_descend")[selected_state - 2]])
+                zone = view.level.height_zones[tile_x, tile_y, z]
                 if not self.render_mode:
-                    view.level.height_zones[tile_x, tile_y, z].target_height += (1, 5, -1, -5)[selected_state - 2]
+                    zone = HeightZone(zone.target_height + (1, 5, -1, -5)[selected_state - 2],
+                                      zone.target_render_offset)
                 else:
-                    view.level.height_zones[tile_x, tile_y, z].target_render_offset += (1, 5, -1, -5)[
-                        selected_state - 2]
+                    zone = HeightZone(zone.target_height,
+                                      zone.target_render_offset + (1, 5, -1, -5)[selected_state - 2])
+                view.level.height_zones[tile_x, tile_y, z] = zone
 
     @classmethod
     def _initialize(cls):
@@ -2339,10 +2464,11 @@ class LoadingZoneLayer(TilemapEditingLayer):
                                                     {"Target Level": data.target_level, "Height": data.target_pos[2]}
                                                     ]).result
                     if new_data is not None:
-                        view.level.loading_zones[tile_x, tile_y].target_pos = [int(new_data[0]["Target X"]),
-                                                                               int(new_data[0]["Target Y"]),
-                                                                               int(new_data[1]["Height"])]
-                        view.level.loading_zones[tile_x, tile_y].target_level = new_data[1]["Target Level"]
+                        # Replace the zone rather than editing it in place, as zones may be shared between copies
+                        view.level.loading_zones[tile_x, tile_y] = LoadingZone(new_data[1]["Target Level"],
+                                                                               [int(new_data[0]["Target X"]),
+                                                                                int(new_data[0]["Target Y"]),
+                                                                                int(new_data[1]["Height"])])
                 view.redraw_view()
 
         elif mode == 3:
@@ -2494,6 +2620,170 @@ class LightLayer(TilemapEditingLayer):
                                                             ''')
 
 
+def render_minimap(level, selected_height=0):
+    """Render the level's tiles and the decos at the selected height (all of them, if 0) to an image, 8 pixels to a
+    tile.  Only reads the level, so it can be given a snapshot on another thread."""
+    if numpy is not None:
+        return render_minimap_array(level, selected_height)
+    image = Image.new('RGBA', (8 * level.level_width, 8 * level.level_height))
+    for x, y, tile_id in level.tilemap.iter_cells():
+        paste_mini_img(image, TilemapLayer.mini_img_dict[tile_id], x, y)
+
+    decos = level.decomap.filter_height(selected_height)
+    decos.sort(key=minimap_order)
+    for deco in decos:
+        if deco.deco_id != 0:
+            paste_mini_img(image, DecomapLayer.mini_img_dict[deco.deco_id], deco.x, deco.y)
+    return image
+
+
+def paste_mini_img(image, mini_img, x, y, size=8):
+    """Draw a mini image onto the minimap at tile x-y, tiles being 'size' pixels square"""
+    image.paste(mini_img, box=(x * size, y * size), mask=mini_img if mini_img.mode == 'RGBA' else None)
+
+
+def minimap_order(deco):
+    """Sort key for the order decos are drawn onto the minimap in"""
+    return deco.height + deco.y + deco.render_offset
+
+
+def minimap_atlas(mini_img_dict, ids):
+    """Returns the 8x8 images of the given ids as (pixels, mask) arrays of shape (len(ids), 8, 8, 4), for
+    render_minimap_array.  Images without an alpha channel are pasted without a mask, so they get a mask of 255."""
+    pixels = numpy.empty((len(ids), 8, 8, 4), dtype=numpy.int32)
+    masks = numpy.empty((len(ids), 8, 8, 1), dtype=numpy.int32)
+    for i, image_id in enumerate(ids.tolist()):
+        mini_img = mini_img_dict[image_id]
+        pixels[i] = numpy.asarray(mini_img.convert('RGBA'))
+        masks[i] = pixels[i, :, :, 3:] if mini_img.mode == 'RGBA' else 255
+    return pixels, masks
+
+
+def blend_minimap(under, pixels, masks):
+    """Composite 'pixels' over 'under' through 'masks', rounding exactly like Image.paste does"""
+    result = under * (255 - masks) + pixels * masks + 128
+    return ((result >> 8) + result) >> 8
+
+
+def render_minimap_array(level, selected_height=0):
+    """render_minimap, with NumPy: the image is assembled from arrays of the tiles' and decos' mini images rather than
+    pasted together piece by piece.  The image comes out exactly the same."""
+    width, height = level.level_width, level.level_height
+    # Pixels are kept as (tile row, tile column, pixel row, pixel column, channel) until the end
+    tile_ids, tiles = numpy.unique(numpy.array(list(level.tilemap.rows()), dtype=numpy.int64), return_inverse=True)
+    pixels, masks = minimap_atlas(TilemapLayer.mini_img_dict, tile_ids)
+    blocks = blend_minimap(0, pixels, masks).astype(numpy.uint8)
+    # Like render_minimap, leave tiles holding the tilemap's default empty
+    blocks[tile_ids == level.tilemap.default] = 0
+    cells = blocks[tiles.reshape(height, width)]
+
+    decos = [deco for deco in level.decomap.filter_height(selected_height) if deco.deco_id != 0]
+    if decos:
+        decos.sort(key=minimap_order)
+        xs = numpy.fromiter((deco.x for deco in decos), dtype=numpy.int64, count=len(decos))
+        ys = numpy.fromiter((deco.y for deco in decos), dtype=numpy.int64, count=len(decos))
+        deco_ids, indices = numpy.unique(numpy.fromiter((deco.deco_id for deco in decos), dtype=numpy.int64,
+                                                        count=len(decos)), return_inverse=True)
+        pixels, masks = minimap_atlas(DecomapLayer.mini_img_dict, deco_ids)
+
+        # Decos on the same tile have to be drawn over each other in order.  Number each deco by how many come before
+        # it on its tile, then draw all the first decos of their tiles at once, then all the second ones, and so on.
+        cell = ys * width + xs
+        order = numpy.argsort(cell, kind='stable')
+        starts = numpy.ones(len(decos), dtype=bool)
+        starts[1:] = cell[order][1:] != cell[order][:-1]
+        ranks = numpy.empty(len(decos), dtype=numpy.int64)
+        ranks[order] = numpy.arange(len(decos)) - numpy.maximum.accumulate(numpy.where(starts, numpy.arange(len(decos)),
+                                                                                       0))
+        for rank in range(int(ranks.max()) + 1):
+            selected = ranks == rank
+            x, y, index = xs[selected], ys[selected], indices[selected]
+            cells[y, x] = blend_minimap(cells[y, x].astype(numpy.int32), pixels[index], masks[index])
+
+    pixels = cells.transpose(0, 2, 1, 3, 4).reshape(height * 8, width * 8, 4)
+    return Image.fromarray(pixels)
+
+
+class LiveMinimap:
+    """A level's minimap, kept up to date edit by edit: the edit history reports the edits of each transaction, and
+    only the tiles they touched are drawn again.  The image is rendered in full when it is first asked for, and again
+    after edits too broad to follow tile by tile (resizes and whole containers being replaced) or a change of the
+    selected height."""
+
+    def __init__(self, level, selected_height=0):
+        self.level = level
+        self.selected_height = selected_height
+        self._image = None
+        # Bumped whenever the minimap changes, so that copies of it (like the world editor's) can tell they are stale
+        self.revision = 0
+
+    @property
+    def image(self):
+        """The minimap.  Only use it on the Tk thread."""
+        if self._image is None:
+            self._image = render_minimap(self.level, self.selected_height)
+        return self._image
+
+    def copy_image(self):
+        """Returns a copy of the minimap, which may be handed to another thread, or None if it has not been rendered"""
+        return self._image.copy() if self._image is not None else None
+
+    def invalidate(self, selected_height=None):
+        """Throw away the minimap (and change the selected height), so that it is rendered in full when next needed"""
+        if selected_height is not None:
+            self.selected_height = selected_height
+        self._image = None
+        self.revision += 1
+
+    def offer(self, image, revision, selected_height):
+        """Take an image rendered elsewhere from a snapshot of the level at 'revision', unless the minimap has been
+        rendered already or the level or selected height have changed since"""
+        if self._image is None and self.level.revision == revision and self.selected_height == selected_height:
+            self._image = image
+
+    def update(self, changes):
+        """EditHistory hook: draw the tiles affected by (container, key, value) changes again"""
+        level = self.level
+        cells = set()
+        for container, key, value in changes:
+            if container is level.tilemap:
+                cells.add(key)
+            elif container is level.decomap:
+                cells.add(key[1:])
+            elif container is level and key in ("size", "tilemap", "decomap"):
+                self.invalidate()
+                return
+        if not cells:
+            return
+        self.revision += 1
+        if self._image is not None:
+            self.draw_cells(cells)
+
+    def draw_cells(self, cells):
+        """Draw the given tiles of the minimap again, along with the decos on them"""
+        tilemap = self.level.tilemap
+        decos = {}
+        for deco in self.level.decomap.filter_height(self.selected_height):
+            if deco.deco_id != 0 and (deco.x, deco.y) in cells:
+                decos.setdefault((deco.x, deco.y), []).append(deco)
+        blank = Image.new('RGBA', (8, 8))
+        for x, y in cells:
+            if not (0 <= x < tilemap.width and 0 <= y < tilemap.height):
+                continue
+            self._image.paste(blank, box=(x * 8, y * 8))
+            tile_id = tilemap[x, y]
+            if tile_id != tilemap.default:
+                paste_mini_img(self._image, TilemapLayer.mini_img_dict[tile_id], x, y)
+            for deco in sorted(decos.get((x, y), ()), key=minimap_order):
+                paste_mini_img(self._image, DecomapLayer.mini_img_dict[deco.deco_id], x, y)
+
+
+def save_minimap(image, name):
+    """Write a level's minimap to mini/<name>.png, at the configured PNG compression level"""
+    with atomic_write(f'mini/{name}.png', mode="wb") as f:
+        image.save(f, format="PNG", compress_level=config.minimap_compress_level)
+
+
 class TilemapView(tk.Frame):
     __initialized = False
     imgs = {}
@@ -2520,20 +2810,21 @@ class TilemapView(tk.Frame):
         self.copied_zone_coords = None
         self.copied_light = None
         self.selected_height = 0
+        self.closed = False
 
         # Declare the tilemap data
         self.level = Level()
-        self.past_states = []
-        self.future_states = []
+        self.history = EditHistory()
+        self.history.attach(self.level)
+        self.journal = Journal()
+        self.journal.reset(None)
+        self.history.journal = self.journal
+        self.minimap = LiveMinimap(self.level)
+        self.history.minimap = self.minimap
+        # Revision of the minimap last shown in the world editor
+        self.published_minimap = self.minimap.revision
         self.file_path = None
 
-        self.backup_state()
-
-        # Note: Past/current/future level state data follows the format:
-        # past_states: [oldest -> newest], excluding current state
-        # level: current state
-        # future_states: [oldest -> newest], excluding current state
-
         # Create element layout
         self.frame = tk.Frame(parent, borderwidth=1, relief=tk.SUNKEN)
         self.canvas = tk.Canvas(self.frame, width=64 * 16, height=64 * 9, bg=config.canvas_bg, bd=0)
@@ -2552,8 +2843,6 @@ class TilemapView(tk.Frame):
         self.canvas.xview(tk.MOVETO, 0.0)
         self.canvas.yview(tk.MOVETO, 0.0)
 
-        self.image_view = Image.new('RGBA', (8 * 16, 8 * 9))
-
         # Add the view to the parent frame
         # This isn't supposed to be self.frame, but I'm worried if I change it, something will break
         # Will fix later™
@@ -2582,9 +2871,9 @@ class TilemapView(tk.Frame):
                                                "Progress is unsaved.  Would you like to save first?",
                                                icon='warning')
 
-            # User wants to save progress before closing tab
-            if action:
-                self.save_to_file(self.file_path)
+            # User wants to save progress before closing tab.  Stay open if the save was canceled or failed.
+            if action and not self.save_to_file(self.file_path, background=False):
+                return False
 
             # User wants to cancel
             if action is None:
@@ -2593,6 +2882,8 @@ class TilemapView(tk.Frame):
             # User wants to continue without saving
             if action is False:
                 pass
+        self.closed = True
+        self.journal.close()
         self.frame.forget()
         return True
 
@@ -2618,11 +2909,10 @@ class TilemapView(tk.Frame):
         self.canvas.delete("all")
 
         if update_minimap:
-            del self.image_view
-            self.image_view = Image.new('RGBA', (8 * self.level.level_width, 8 * self.level.level_height))
+            self.minimap.invalidate()
 
         for i in (0, 1):
-            self.master.master.layers[i].draw_full(self, update_minimap)
+            self.master.master.layers[i].draw_full(self)
 
         # Draw layer-specific stuff (self.master.master.layer.get())
         if self.master.master.layer.get() >= 2:
@@ -2669,17 +2959,19 @@ class TilemapView(tk.Frame):
     def set_height(self, value):
         """Set which heights are being rendered on the screen"""
         self.selected_height = value
+        self.minimap.invalidate(value)
         self.redraw_view()
 
     def generic_start_draw(self, event, draw_function, limited=False, scale=64, update_save=True):
-        self.backup_state()
+        self.begin_edit()
         self.generic_draw(event, draw_function, limited, scale, update_save)
 
     def generic_flood_fill(self, event, draw_function, scale=64):
         if self.check_bounds(event):
-            self.backup_state()
+            self.begin_edit()
             tile_x, tile_y = self.event_to_tile(event, scale=scale)
             draw_function(self, tile_x, tile_y)
+            self.backup_state()
             self.redraw_view()
 
     def generic_draw(self, event, draw_function, limited=False, scale=64, update_save=True):
@@ -2694,8 +2986,8 @@ class TilemapView(tk.Frame):
 
     def generic_finish_draw(self, event, draw_function, limited=False, scale=64, update_save=True):
         self.canvas.delete("all")
-        self.backup_state()
         self.generic_draw(event, draw_function, limited, scale, update_save)
+        self.backup_state()
         self.redraw_view()
 
     def set_grid(self):
@@ -2763,6 +3055,7 @@ class TilemapView(tk.Frame):
         """Mark the starting position for drawing a line"""
         if not self.check_bounds(event):
             return
+        self.begin_edit()
         x, y = self.event_to_tile(event, scale=1, return_type=float)
         self.line_start_x, self.line_start_y = x, y
         self.canvas.create_rectangle((x - 8, y - 8, x + 8, y + 8),
@@ -2784,8 +3077,6 @@ class TilemapView(tk.Frame):
             self.redraw_view()
             return
 
-        self.backup_state()
-
         # Generate parametric functions x(t) and y(t)
         end_x, end_y = self.event_to_tile(event, scale=1, return_type=float)
         slope_x = (end_x - self.line_start_x) / 100
@@ -2820,42 +3111,46 @@ class TilemapView(tk.Frame):
     def apply_geometry(self):
         """Applies the tile/deco geometry from ids_data"""
         # Reset map
-        for i, j in enumerate(self.level.collider):
-            for k, m in enumerate(j):
-                self.level.collider[i][k] = 0
+        collider = self.level.collider
+        collider.fill(0)
 
         # Obtain selected height
         selected_z = self.selected_height
 
-        # Apply tile geometry
+        # Apply tile geometry.  Default tiles only need visiting if they actually have geometry.
         if selected_z <= 1:
-            for y, i in enumerate(self.level.tilemap):
-                for x, _id in enumerate(i):
-                    self.level.collider[y * 2][x * 2] = TilemapEditorWindow.ids_data["tile_ids"][_id]["geo"][0]
-                    self.level.collider[y * 2 + 1][x * 2] = TilemapEditorWindow.ids_data["tile_ids"][_id]["geo"][1]
-                    self.level.collider[y * 2][x * 2 + 1] = TilemapEditorWindow.ids_data["tile_ids"][_id]["geo"][2]
-                    self.level.collider[y * 2 + 1][x * 2 + 1] = TilemapEditorWindow.ids_data["tile_ids"][_id]["geo"][3]
+            tile_ids = TilemapEditorWindow.ids_data["tile_ids"]
+            skip_default = not any(tile_ids[self.level.tilemap.default]["geo"])
+            for x, y, _id in self.level.tilemap.iter_cells(skip_default=skip_default):
+                collider[x * 2, y * 2] = tile_ids[_id]["geo"][0]
+                collider[x * 2, y * 2 + 1] = tile_ids[_id]["geo"][1]
+                collider[x * 2 + 1, y * 2] = tile_ids[_id]["geo"][2]
+                collider[x * 2 + 1, y * 2 + 1] = tile_ids[_id]["geo"][3]
 
         # Apply deco geometry
-        for deco in self.level.decomap:
-            if selected_z and selected_z != deco.height:
-                continue
-
+        for deco in self.level.decomap.filter_height(selected_z):
             deco_id, x, y = deco.deco_id, deco.x, deco.y
-            self.level.collider[y * 2][x * 2] ^= TilemapEditorWindow.ids_data["deco_ids"][deco_id]["geo"][0]
-            self.level.collider[y * 2 + 1][x * 2] ^= TilemapEditorWindow.ids_data["deco_ids"][deco_id]["geo"][1]
-            self.level.collider[y * 2][x * 2 + 1] ^= TilemapEditorWindow.ids_data["deco_ids"][deco_id]["geo"][2]
-            self.level.collider[y * 2 + 1][x * 2 + 1] ^= TilemapEditorWindow.ids_data["deco_ids"][deco_id]["geo"][3]
+            collider[x * 2, y * 2] ^= TilemapEditorWindow.ids_data["deco_ids"][deco_id]["geo"][0]
+            collider[x * 2, y * 2 + 1] ^= TilemapEditorWindow.ids_data["deco_ids"][deco_id]["geo"][1]
+            collider[x * 2 + 1, y * 2] ^= TilemapEditorWindow.ids_data["deco_ids"][deco_id]["geo"][2]
+            collider[x * 2 + 1, y * 2 + 1] ^= TilemapEditorWindow.ids_data["deco_ids"][deco_id]["geo"][3]
 
     def load_from_file(self, file):
-        """Loads level data from a .json file"""
-        self.backup_state()
-        with open(file, mode="r") as f:
-            level_data = json.load(f)
-            if not self.level.load_from_json(level_data):
-                return False
-            self.saved = True
-            self.file_path = file
+        """Loads level data from a .json or binary level file.  The loaded level starts with a fresh edit history."""
+        self.history.detach(self.level)
+        try:
+            self.level.load_from_file(file, lambda message: messagebox.showerror("Error", message))
+        except (OSError, ValueError) as error:
+            messagebox.showerror("Error", f'Failed to load level: {error}')
+            return False
+        finally:
+            self.history.attach(self.level)
+        self.journal.reset(file)
+        # The minimap saved along with the file is already up to date
+        self.minimap.invalidate()
+        self.published_minimap = self.minimap.revision
+        self.saved = True
+        self.file_path = file
         self.set_border(self.master.master.border_mode.get())
         self.update_title()
         self.apply_geometry()
@@ -2866,23 +3161,12 @@ class TilemapView(tk.Frame):
         """Saves the level data to the file defined by self.file_path"""
         self.save_to_file(self.file_path)
 
-    def save_to_file(self, file):
-        """Saves the level data to a .json file"""
+    def save_to_file(self, file, background=True):
+        """Saves the level data to a .json or binary level file.  The files are written from a snapshot of the level by
+        the save worker (or right away, if background is False), and the view counts as saved once that has finished.
+        Returns False if the user canceled the save, or if it was not done in the background and failed."""
         # Save the ids_data to ids.json
-        with open("assets/ids.json", mode="w") as f:
-            # Format the ids data
-            formatted_ids = {}
-            for list_name, id_list in TilemapEditorWindow.ids_data.items():
-                formatted_ids[list_name] = []
-                for _id, data in id_list.items():
-                    formatted_ids[list_name].append({"id": _id, "tex": data["tex"], "geo": data["geo"]})
-                    if "height" in data:
-                        formatted_ids[list_name][-1]["height"] = data["height"]
-
-            # Save the id list to the file in a readable format
-            ids_data = json.dumps(formatted_ids, indent=2)
-            ids_data = re.sub(r'\[\s+(\d),\s+(\d),\s+(\d),\s+(\d)\s+\]', r'[\1, \2, \3, \4]', ids_data)
-            f.write(ids_data)
+        ids = TilemapEditorWindow.dump_ids()
 
         # If this file is NOT part of the project and hasn't been excluded, ask whether it should be.
         print("Ignore level from project:", self.level.ignore_from_project)
@@ -2897,7 +3181,7 @@ class TilemapView(tk.Frame):
                                                                                        "remains in the editor)")
                 if result is None:
                     # User canceled the saving process
-                    return
+                    return False
                 elif result:
                     # User added level to project.json
                     remember_to_include = True
@@ -2905,21 +3189,20 @@ class TilemapView(tk.Frame):
                     # User excluded level from project.json
                     self.level.ignore_from_project = True
 
-        # Save the project data to project.json
-        App.save_project_data()
-
         # No file path has been set
         if file is None:
-            file = filedialog.asksaveasfilename(filetypes=[('JSON File', '*.json')],
+            file = filedialog.asksaveasfilename(filetypes=[('JSON File', '*.json'),
+                                                           ('Compressed JSON File', '*.json.gz *.json.xz'),
+                                                           ('Binary Level', '*' + Level.binary_extension)],
                                                 defaultextension=[('JSON File', '*.json')])
             print("File: ", file)
             if file == "":
                 # User canceled saving, exit function
-                return
+                return False
 
             # Obtain and save file path
             file = path.split(file)[1]
-            self.level.name = path.splitext(file)[0]
+            self.level.name = path.splitext(split_compression(file)[0])[0]
             file = path.join("maps", file)
             self.file_path = file
 
@@ -2928,46 +3211,149 @@ class TilemapView(tk.Frame):
                 App.project_data["levels"][self.level.name] = {"path": "", "world_pos": self.level.world_pos}
 
         # Only apply this part of the level is in project.json
-        if self.level.name in App.project_data["levels"]:
+        in_project = self.level.name in App.project_data["levels"]
+        if in_project:
             # Save relative path to project.json
             relative_path = file.replace((getcwd() + '/').replace('\\', '/'), '')
-            App.project_data["levels"][self.level.name]["path"] = relative_path
+            if App.project_data["levels"][self.level.name]["path"] != relative_path or remember_to_include:
+                App.project_data["levels"][self.level.name]["path"] = relative_path
+                App.mark_project_dirty("levels", self.level.name)
 
+        # Save the project data to project.json
+        project_data = App.dump_project_data()
+
+        if MappedGrid.is_mapped(file) and not self.level.writes_in_place(file):
+            # The file is going to be replaced, so the grids mapping it have to let go of it first (see
+            # MappedGrid.release).  Earlier saves may still be reading from it.
+            self.master.master.save_worker.wait()
+            self.master.master.minimap_worker.wait()
+            MappedGrid.release(file)
+
+        # Everything from here on works on a snapshot, which later edits do not affect
+        level = self.level.copy()
+        selected_height = self.selected_height
+        revision = self.level.revision
+        journal = self.journal
+        checkpoint = journal.checkpoint()
+        minimap = minimap_revision = None
+        if in_project:
+            # Take the live minimap as it is, rather than rendering it again (unless it has not been rendered yet)
+            self.minimap.update(self.history.pending())
+            minimap = self.minimap.copy_image()
+            minimap_revision = self.minimap.revision
+
+        def save():
+            if ids is not None:
+                TilemapEditorWindow.write_ids(*ids)
+            if project_data is not None:
+                App.write_project_data(*project_data)
+
+            # Write the level to file
+            level.save_to_file(file)
+            # Drop the saved edits from the journal straight away, rather than in _save_finished, so that it is
+            # already done if the editor is closed before the callbacks get to run
+            journal.compact(checkpoint, file)
+
+        def save_screenshot():
             # Save a screenshot of the entire file
-            self.redraw_view(True)
-            self.image_view.save(f'mini/{self.level.name}.png')
+            image = minimap if minimap is not None else render_minimap(level, selected_height)
+            save_minimap(image, level.name)
+            return image
 
-            # Also save the screenshot to the WorldEditorWindow
-            del WorldEditorWindow.mini_maps[self.level.name]
-            WorldEditorWindow.mini_maps[self.level.name] = ImageTk.PhotoImage(self.image_view)
+        def finished(result):
+            self._save_finished(file, revision)
 
-        # Write json tag to file
-        with open(file, mode="w") as f:
-            f.write(self.level.jsonify())
-        self.saved = True
+        def failed(error):
+            messagebox.showerror("Error", f'Could not save {file}: {error}')
+
+        def minimap_finished(image):
+            self._minimap_finished(level.name, image, revision, selected_height, minimap_revision)
+
+        def minimap_failed(error):
+            messagebox.showerror("Error", f'Could not save the minimap of {level.name}: {error}')
+
+        if background:
+            self.master.master.save_worker.submit(save, finished, failed)
+            if in_project:
+                self.master.master.minimap_worker.submit(save_screenshot, minimap_finished, minimap_failed)
+            return True
+
+        try:
+            save()
+        except Exception as error:
+            failed(error)
+            return False
+        finished(None)
+        if in_project:
+            # The level itself has been saved, so a minimap that could not be saved does not fail the save
+            try:
+                image = save_screenshot()
+            except Exception as error:
+                minimap_failed(error)
+            else:
+                minimap_finished(image)
+        return True
+
+    def _minimap_finished(self, name, image, revision, selected_height, minimap_revision):
+        """Completion callback for the minimap of a save, called on the Tk thread"""
+        # Keep the screenshot as the live minimap, if it had to be rendered and is still current
+        self.minimap.offer(image, revision, selected_height)
+        # Also save the screenshot to the WorldEditorWindow
+        WorldEditorWindow.set_mini_map(name, image)
+        if self.minimap.revision == minimap_revision:
+            self.published_minimap = minimap_revision
+
+    def publish_minimap(self):
+        """Show the level as it is now in the world editor, if it is part of the project and has changed since it was
+        last shown"""
+        if self.level.name in App.project_data["levels"] and self.minimap.revision != self.published_minimap:
+            WorldEditorWindow.set_mini_map(self.level.name, self.minimap.image)
+            self.published_minimap = self.minimap.revision
+
+    def _save_finished(self, file, revision):
+        """Completion callback for save_to_file, called on the Tk thread"""
+        if self.closed:
+            return
+
+        if self.level.revision == revision:
+            # Also makes a journal that broke usable again
+            self.journal.reset(file)
+            self.saved = True
+        # Otherwise the level was edited while it was being saved.  Those edits still need saving, and the save job
+        # has already compacted the journal down to them.
+        self.update_title()
+
+    def recover(self, journal_file):
+        """Replay the edits in a journal left behind by an earlier session on top of this view's level (which should be
+        the journal's base level), then carry on with them in this view's own journal"""
+        base, records, data = Journal.read(journal_file)
+        self.history.detach(self.level)
+        for changes in records:
+            for name, key, value in changes:
+                container = self.level if name is None else getattr(self.level, name)
+                container.restore(key, EditHistory._decode(value))
+        self.history.attach(self.level)
+        self.journal.reset(base, data)
+        self.minimap.invalidate()
+        remove(journal_file)
+        self.saved = False
+        self.set_border(self.master.master.border_mode.get())
         self.update_title()
+        self.apply_geometry()
+        self.redraw_view()
+
+    def begin_edit(self):
+        """Open the undo step for a new gesture (a press of the mouse button).  Anything edited since the last step was
+        closed ends up in a step of its own."""
+        self.history.begin()
 
     def backup_state(self):
-        """Save a backup of the current level state"""
-        # Only update if something changed.
-        if len(self.past_states) == 0 or self.level != self.past_states[-1]:
-            self.past_states.append(self.level.copy())
-            self.future_states = []
+        """Close the current undo step, if anything changed since it was opened"""
+        self.history.commit()
 
     def undo(self):
         """Return to the previous level state"""
-        if len(self.past_states) > 0:
-            # If the current state is identical to the previous, go back two states
-            if self.level == self.past_states[-1]:
-                self.future_states.insert(0, self.level.copy())
-                self.level = self.past_states.pop(-1).copy()
-                if len(self.past_states) <= 0:
-                    return
-
-            # Save current state to future, and load an older one
-            self.future_states.insert(0, self.level.copy())
-            self.level = self.past_states.pop(-1).copy()
-
+        if self.history.undo():
             # Reload map and update saved status
             self.redraw_view()
             self.saved = False
@@ -2975,11 +3361,7 @@ class TilemapView(tk.Frame):
 
     def redo(self):
         """Return to a future level state"""
-        if len(self.future_states) > 0:
-            # Save currents state to past, and load a future one
-            self.past_states.append(self.level.copy())
-            self.level = self.future_states.pop(0).copy()
-
+        if self.history.redo():
             # Reload map and update saved status
             self.redraw_view()
             self.saved = False
@@ -2996,17 +3378,240 @@ class TilemapView(tk.Frame):
         cls.imgs = {"border": border_tile_data}
 
 
+# Matches the numbers that the compact JSON layout keeps on one line
+json_number = re.compile(r'[0-9.\-]+').fullmatch
+
+
+def json_key(key):
+    """Returns a dictionary key as it is written in JSON.  Keys that are not strings, like those of the ids data, are
+    written as the string of their own JSON."""
+    return json.dumps(key if isinstance(key, str) else json.dumps(key))
+
+
+def iter_json(value, indent="\n"):
+    """Encode a value as JSON in the editor's compact layout, yielding the text piece by piece.  The layout is that of
+    json.dumps(indent=2), except that numbers stay on the line of whatever comes before them: [1, 2, 3] rather than
+    one number per line."""
+    if isinstance(value, dict):
+        if not value:
+            yield "{}"
+            return
+        inner = indent + "  "
+        last = len(value) - 1
+        yield "{"
+        for i, (key, item) in enumerate(value.items()):
+            yield inner + json_key(key) + ": "
+            if isinstance(item, (dict, list, tuple)):
+                yield from iter_json(item, inner)
+                if i != last:
+                    yield ","
+            else:
+                text = json.dumps(item)
+                if i == last:
+                    yield text
+                elif json_number(text):
+                    yield text + ", "
+                else:
+                    yield text + ","
+        yield indent + "}"
+
+    elif isinstance(value, (list, tuple)):
+        if not value:
+            yield "[]"
+        elif set(map(type, value)) == {int}:
+            # Fast path for rows of numbers, such as the tilemap's
+            yield "[" + ", ".join(map(str, value)) + "]" if len(value) > 1 else "[ {}]".format(value[0])
+        elif (set(map(type, value)) == {list} and min(map(len, value)) > 1 and
+              set(map(type, chain.from_iterable(value))) == {int}):
+            # Fast path for lists of rows of numbers, such as the tilemap and decomap.  Python's own formatting of the
+            # whole list only needs the rows putting on lines of their own.
+            inner = indent + "  "
+            yield "[" + inner + str(value)[1:-1].replace("], [", "]," + inner + "[") + indent + "]"
+        else:
+            inner = indent + "  "
+            last = len(value) - 1
+            after_number = False
+            yield "["
+            for i, item in enumerate(value):
+                if isinstance(item, (dict, list, tuple)):
+                    yield inner
+                    yield from iter_json(item, inner)
+                    yield "," if i != last else indent + "]"
+                    after_number = False
+                else:
+                    text = json.dumps(item)
+                    if not json_number(text):
+                        yield inner + text + ("," if i != last else indent + "]")
+                        after_number = False
+                    elif i != last:
+                        yield text + ", "
+                        after_number = True
+                    else:
+                        yield (text if after_number else " " + text) + "]"
+
+    else:
+        yield json.dumps(value)
+
+
+def pack_value(out, value):
+    """Append a tagged binary encoding of a JSON-style value (None, bool, int, float, str or list) to the list of bytes
+    'out'.  The tags keep ints and floats apart, so values come back exactly as they went in."""
+    if value is None:
+        out.append(b"n")
+    elif isinstance(value, bool):
+        out.append(b"t" if value else b"f")
+    elif isinstance(value, int):
+        out.append(b"i" + struct.pack("<q", value))
+    elif isinstance(value, float):
+        out.append(b"d" + struct.pack("<d", value))
+    elif isinstance(value, str):
+        encoded = value.encode("utf-8")
+        out.append(b"s" + struct.pack("<I", len(encoded)) + encoded)
+    elif isinstance(value, (list, tuple)):
+        out.append(b"l" + struct.pack("<I", len(value)))
+        for i in value:
+            pack_value(out, i)
+    else:
+        raise TypeError("Cannot pack a {}".format(type(value).__name__))
+
+
+def unpack_value(data, position):
+    """Decode a value written by pack_value, starting at 'position'.  Returns (value, position after it)."""
+    tag = data[position:position + 1]
+    position += 1
+    if tag == b"n":
+        return None, position
+    if tag in (b"t", b"f"):
+        return tag == b"t", position
+    if tag == b"i":
+        return struct.unpack_from("<q", data, position)[0], position + 8
+    if tag == b"d":
+        return struct.unpack_from("<d", data, position)[0], position + 8
+    if tag == b"s":
+        length, = struct.unpack_from("<I", data, position)
+        position += 4
+        if position + length > len(data):
+            raise ValueError("Truncated string")
+        return data[position:position + length].decode("utf-8"), position + length
+    if tag == b"l":
+        length, = struct.unpack_from("<I", data, position)
+        position += 4
+        result = []
+        for _ in range(length):
+            value, position = unpack_value(data, position)
+            result.append(value)
+        return result, position
+    raise ValueError("Unknown value tag {!r}".format(tag))
+
+
+def pack_ints(values):
+    """Pack integers as little-endian int32"""
+    result = array('i', values)
+    if byteorder == "big":
+        result.byteswap()
+    return result.tobytes()
+
+
+def unpack_ints(data, position, count):
+    """Unpack 'count' little-endian int32 starting at 'position'.  Returns (array, position after them)."""
+    end = position + 4 * count
+    if end > len(data):
+        raise ValueError("Truncated integer array")
+    result = array('i')
+    result.frombytes(data[position:end])
+    if byteorder == "big":
+        result.byteswap()
+    return result, end
+
+
+def rle_encode(row):
+    """Run-length encode a row of values as a flat [value, count, value, count, ...] list"""
+    result = []
+    for value, run in groupby(row):
+        result.append(value)
+        result.append(sum(1 for _ in run))
+    return result
+
+
+def rle_decode(runs):
+    """Expand a row encoded by rle_encode"""
+    result = []
+    for i in range(0, len(runs), 2):
+        result.extend(repeat(runs[i], runs[i + 1]))
+    return result
+
+
+# Files ending in one of these extensions are transparently compressed with the matching module
+compression_modules = {".gz": gzip, ".xz": lzma}
+
+
+def split_compression(file):
+    """Returns (file without its compression extension, compression module), or (file, None) for plain files"""
+    root, extension = path.splitext(file)
+    module = compression_modules.get(extension.lower())
+    if module is None:
+        return file, None
+    return root, module
+
+
+def open_compressed(file, mode="r"):
+    """Open a file, decompressing or compressing it if its extension says so"""
+    module = split_compression(file)[1]
+    if module is None:
+        return open(file, mode=mode)
+    return module.open(file, mode=mode if "b" in mode else mode + "t")
+
+
+@contextmanager
+def atomic_write(file, mode="w"):
+    """Open a temporary file for writing, which takes the place of 'file' once it has been written in full.  If writing
+    fails part way, 'file' is left as it was.  Files with a compression extension are compressed on the way."""
+    temp = "{}.{}.tmp".format(file, threading.get_ident())
+    module = split_compression(file)[1]
+    f = open(temp, mode="wb" if module is not None else mode)
+    try:
+        with f:
+            if module is None:
+                yield f
+            else:
+                # Closing the compressed stream finishes it, but leaves the underlying file open to be synced
+                with module.open(f, mode=mode if "b" in mode else mode + "t") as compressed:
+                    yield compressed
+            f.flush()
+            fsync(f.fileno())
+    except BaseException:
+        remove(temp)
+        raise
+    replace(temp, file)
+
+
 class Level:
     """Container structure for level data"""
 
+    # Version of the JSON level format written by json_data.  Files of older versions (those without a format_version
+    # are version 0) are brought up to date by the _upgrade_json_<version> methods when they are loaded.
+    format_version = 1
+    # Binary level files (see write_binary)
+    binary_extension = ".wbl"
+    binary_magic = b"WB2L"
+    binary_version = 1
+    binary_header = struct.Struct("<4sHIIIIII")
+    # An in-place save first copies what it is about to overwrite to the level file's name plus this, and deletes the
+    # copy once it is done.  If that never happens, the file is put back as it was before it is next loaded.
+    rollback_extension = ".rollback"
+
+    # Attributes whose reassignment is reported to the recorder (see EditHistory).  The collider is left out, as it is
+    # derived from the tilemap and decomap.
+    recorded_attributes = ("tilemap", "decomap", "loading_zones", "lightmap", "height_zones", "default_start",
+                           "world_pos", "name")
+    recorder = None
+
     def __init__(self):
         self.name = "Untitled"
         self.world_pos = [0, 0]
-        self.level_width = 16 + 2
-        self.level_height = 9 + 2
-        self.tilemap = [[0] * self.level_width for i in range(self.level_height)]
-        self.decomap = Decomap()
-        self.collider = [[0] * (self.level_width * 2) for i in range(self.level_height * 2)]
+        self.tilemap = self.new_grid(16 + 2, 9 + 2)
+        self.decomap = self.new_decomap()
+        self.collider = self.new_grid(self.level_width * 2, self.level_height * 2)
         self.default_start = [0, 0]
         self.lightmap = LightmapDict()
         self.loading_zones = LoadingZoneDict()
@@ -3015,81 +3620,353 @@ class Level:
         # Special Status data
         self.ignore_from_project = False
 
+    @property
+    def level_width(self):
+        """Width of the level, in tiles"""
+        return self.tilemap.width
+
+    @property
+    def level_height(self):
+        """Height of the level, in tiles"""
+        return self.tilemap.height
+
+    def new_decomap(self):
+        """Create an empty decomap using the configured container type"""
+        return ColumnarDecomap() if config.columnar_decomap else Decomap()
+
+    def new_grid(self, width, height, rows=None):
+        """Create a grid (optionally filled from a list of rows), stored sparsely if it is large enough to warrant it"""
+        grid_type = ChunkedGrid if width * height > config.sparse_threshold else Grid
+        if rows is None:
+            return grid_type(width, height)
+        return grid_type.from_rows(rows)
+
+    def __setattr__(self, name, value):
+        # Replacing an attribute (including whole containers) counts as a modification
+        old = self.__dict__.get(name)
+        if name in self.recorded_attributes and isinstance(value, RevisionTracked):
+            value.recorder = self.recorder
+            value.name = name
+        super().__setattr__(name, value)
+        super().__setattr__("_revision", next(revision_counter))
+
+        if name == "recorder":
+            # Hand the recorder down to the containers
+            for i in self.recorded_attributes:
+                if isinstance(self.__dict__.get(i), RevisionTracked):
+                    self.__dict__[i].recorder = value
+        elif self.recorder is not None and name in self.recorded_attributes and old is not value:
+            self.recorder.record(self, name, old, value)
+
+    def restore(self, key, value):
+        """Undo/redo hook for EditHistory: put the attribute 'key' back to 'value'"""
+        if key == "size":
+            self._resize(*value)
+        else:
+            setattr(self, key, value)
+            if (self.collider.width, self.collider.height) != (self.level_width * 2, self.level_height * 2):
+                self.collider = self.new_grid(self.level_width * 2, self.level_height * 2)
+
     def __eq__(self, other):
         if type(other) != Level:
             return False
         else:
-            return str(self.jsonify()) == str(other.jsonify())
+            return self.fingerprint() == other.fingerprint()
 
     def __ne__(self, other):
-        if type(other) != Level:
-            return True
-        else:
-            return str(self.jsonify()) != str(other.jsonify())
+        return not self == other
 
-    def load_from_json(self, data):
-        """Load level data from a JSON representation"""
-        # TODO: Shift responsibility of loading components to their respective classes
+    @property
+    def revision(self):
+        """Modification counter covering the level's attributes and containers.  It only ever increases.  The collider
+        is left out, as it is derived from the rest (and rebuilt whenever the collision layer is drawn)."""
+        return max(self._revision, self.tilemap.revision, self.decomap.revision, self.loading_zones.revision,
+                   self.lightmap.revision, self.height_zones.revision)
+
+    def fingerprint(self):
+        """Returns a summary of everything that ends up in the level's JSON, built from the containers' content
+        hashes, so comparing two levels does not require serializing them"""
+        return (self.level_width, self.level_height, self.tilemap.content_hash, self.decomap.content_hash,
+                self.loading_zones.content_hash, self.lightmap.content_hash, self.height_zones.content_hash,
+                tuple(self.default_start), tuple(self.world_pos), self.name)
+
+    def load_from_json(self, data, warn=print):
+        """Load level data from a JSON representation, upgrading it to the current format_version first if it was
+        written by an older version of the editor.  Raises ValueError if the data cannot be loaded; warn(message) is
+        called about problems that were worked around."""
+        version = data.get("format_version", 0)
+        if version > self.format_version:
+            raise ValueError(f'it was saved in a newer format (version {version})')
         try:
-            self.tilemap = data["tilemap"]
-            self.level_width = len(self.tilemap[0])
-            self.level_height = len(self.tilemap)
-            self.decomap = Decomap()
-            # Note: This is still here in case I ever need to upgrade an older map
-            #        for y, j in enumerate(data["decomap"]):
-            #            for x, m in enumerate(j):
-            #                if m != 0:
-            #                    self.decomap.add(m, x, y, TilemapEditorWindow.ids_data["deco_ids"][m]["height"])
+            while version < self.format_version:
+                data = getattr(self, f'_upgrade_json_{version}')(data)
+                version += 1
+            self._load_json(data, warn)
+        except KeyError as error:
+            raise ValueError(f'an issue was detected with \'{error}\'') from error
+        except TypeError as error:
+            raise ValueError(str(error)) from error
 
-            try:
-                for deco_id, x, y, height, render_offset in data["decomap"]:
-                    self.decomap.add(deco_id, x, y, height, render_offset)
-            except ValueError:
-                for deco_id, x, y in data["decomap"]:
-                    self.decomap.add(deco_id, x, y, TilemapEditorWindow.ids_data["deco_ids"][deco_id]["height"])
-
-            self.collider = [[0] * (self.level_width * 2) for i in range(self.level_height * 2)]
-            self.loading_zones = LoadingZoneDict()
-            for i in data["loading_zones"]:
-                self.loading_zones[i["zone"][0], i["zone"][1]] = LoadingZone(i["target_level"], i["target_pos"])
-            for i in data["lightmap"]:
-                red = ColorFade(i["red"]["amplitude"], i["red"]["inner_diameter"], i["red"]["outer_diameter"])
-                green = ColorFade(i["green"]["amplitude"], i["green"]["inner_diameter"], i["green"]["outer_diameter"])
-                blue = ColorFade(i["blue"]["amplitude"], i["blue"]["inner_diameter"], i["blue"]["outer_diameter"])
-                self.lightmap[i["pos"][0], i["pos"][1]] = Light(i["diameter"], red, green, blue, i["blacklight"], True)
-            for i in data["height_zones"]:
-                self.height_zones[i["zone"][0], i["zone"][1], i["zone"][2]] = HeightZone(i["target_height"],
-                                                                                         i["target_render_offset"])
-            self.default_start = data["spawn"]
-            self.name = data["name"]
-            if self.name in App.project_data["levels"]:
-                # If level was found in project.json, prioritize that.
-                self.world_pos = App.project_data["levels"][self.name]["world_pos"]
+    @staticmethod
+    def _upgrade_json_0(data):
+        """Upgrade level data from before format_version was written.  Those levels may store decos as [deco_id, x, y],
+        taking their height from the ids data, and may not have a world_pos."""
+        # Note: Levels older still stored the decomap as a grid of deco ids.  This is how they were upgraded:
+        #        for y, j in enumerate(data["decomap"]):
+        #            for x, m in enumerate(j):
+        #                if m != 0:
+        #                    self.decomap.add(m, x, y, TilemapEditorWindow.ids_data["deco_ids"][m]["height"])
+        data = dict(data)
+        if any(len(i) == 3 for i in data["decomap"]):
+            deco_ids = TilemapEditorWindow.ids_data["deco_ids"]
+            data["decomap"] = [[i[0], i[1], i[2], deco_ids[i[0]]["height"], 0] if len(i) == 3 else i
+                               for i in data["decomap"]]
+        data.setdefault("world_pos", None)
+        data["format_version"] = 1
+        return data
+
+    def _load_json(self, data, warn):
+        """Load level data in the current format_version, building each container in one go.  Nothing is changed if
+        the data turns out to be incomplete."""
+        # TODO: Shift responsibility of loading components to their respective classes
+        if "tilemap_rle" in data:
+            rows = [rle_decode(i) for i in data["tilemap_rle"]]
+        else:
+            rows = data["tilemap"]
+        tilemap = self.new_grid(len(rows[0]), len(rows), rows)
+        decomap = self.new_decomap()
+        decomap.extend(data["decomap"])
+        loading_zones = LoadingZoneDict.from_entries(
+            ((i["zone"][0], i["zone"][1]), LoadingZone(i["target_level"], i["target_pos"]))
+            for i in data["loading_zones"])
+        lightmap = LightmapDict.from_entries(
+            ((i["pos"][0], i["pos"][1]), Light(i["diameter"], ColorFade(**i["red"]), ColorFade(**i["green"]),
+                                               ColorFade(**i["blue"]), i["blacklight"], True))
+            for i in data["lightmap"])
+        height_zones = HeightZoneDict.from_entries(
+            ((i["zone"][0], i["zone"][1], i["zone"][2]), HeightZone(i["target_height"], i["target_render_offset"]))
+            for i in data["height_zones"])
+        default_start, name, world_pos = data["spawn"], data["name"], data["world_pos"]
+
+        self.tilemap = tilemap
+        self.decomap = decomap
+        self.collider = self.new_grid(self.level_width * 2, self.level_height * 2)
+        self.loading_zones = loading_zones
+        self.lightmap = lightmap
+        self.height_zones = height_zones
+        self.default_start = default_start
+        self.name = name
+        self._place_in_world(world_pos, warn)
+
+    def _place_in_world(self, world_pos, warn):
+        """Set the world position of a freshly loaded level: the one in project.json if the level is part of the
+        project, otherwise the one from the level file (None if it had none)"""
+        project_level = App.project_data["levels"].get(self.name)
+        if project_level is not None:
+            # If level was found in project.json, prioritize that.
+            self.world_pos = project_level["world_pos"]
+        elif world_pos is not None:
+            # If the level was not found in project.json, use the value reported by the level file
+            self.world_pos = world_pos
+        else:
+            # No world position was found, default to [0, 0]
+            self.world_pos = [0, 0]
+            warn("No world_pos tag was found, defaulting to [0, 0]")
+
+    def load_from_binary(self, data, file=None, warn=print):
+        """Load level data from the binary representation written by write_binary.  If 'data' is a memory map of
+        'file', the tilemap is left in the file (see MappedGrid).  Raises ValueError if the data cannot be loaded."""
+        try:
+            magic, version, width, height, deco_count, zone_count, light_count, height_zone_count = \
+                self.binary_header.unpack_from(data)
+            if magic != self.binary_magic:
+                raise ValueError("Not a level file")
+            if version != self.binary_version:
+                raise ValueError(f'Unsupported version {version}')
+            (name, default_start, world_pos), position = unpack_value(data, self.binary_header.size)
+
+            if file is not None:
+                self.tilemap = MappedGrid.from_mapping(data, position, width, height, file)
+                position += 4 * width * height
             else:
+                tiles, position = unpack_ints(data, position, width * height)
+                self.tilemap = self.new_grid(width, height, [tiles[i:i + width].tolist()
+                                                             for i in range(0, width * height, width)])
+            decos, position = unpack_ints(data, position, deco_count * 5)
+            self.decomap = self.new_decomap()
+            self.decomap.extend(decos[i:i + 5] for i in range(0, deco_count * 5, 5))
+            self.collider = self.new_grid(self.level_width * 2, self.level_height * 2)
+
+            records = []
+            for _ in range(zone_count):
+                (x, y, target_level, target_pos), position = unpack_value(data, position)
+                records.append(((x, y), LoadingZone(target_level, target_pos)))
+            self.loading_zones = LoadingZoneDict.from_entries(records)
+            records = []
+            for _ in range(light_count):
+                (x, y, diameter, red, green, blue, blacklight), position = unpack_value(data, position)
+                records.append(((x, y), Light(diameter, ColorFade(*red), ColorFade(*green), ColorFade(*blue),
+                                              blacklight, True)))
+            self.lightmap = LightmapDict.from_entries(records)
+            records = []
+            for _ in range(height_zone_count):
+                (x, y, z, target_height, target_render_offset), position = unpack_value(data, position)
+                records.append(((x, y, z), HeightZone(target_height, target_render_offset)))
+            self.height_zones = HeightZoneDict.from_entries(records)
+        except (struct.error, TypeError) as error:
+            raise ValueError(str(error)) from error
+
+        self.default_start = default_start
+        self.name = name
+        self._place_in_world(world_pos, warn)
+
+    def write_binary(self, f):
+        """Write the level to a binary file: a header with the size and record counts, then the name, spawn and world
+        position, the tiles as int32, the decos as 5 int32 each, and finally the loading zones, lights and height zones,
+        one list of fields per record.  Everything apart from the two int32 arrays is written with pack_value."""
+        head, tail = self._binary_sections()
+        f.write(head)
+        for row in self.tilemap.rows():
+            f.write(pack_ints(row))
+        f.write(tail)
+
+    def _binary_sections(self):
+        """Returns the parts of the binary representation before and after the tiles"""
+        decos = self.decomap.jsonify()
+        head = [self.binary_header.pack(self.binary_magic, self.binary_version, self.level_width, self.level_height,
+                                        len(decos), len(self.loading_zones.data), len(self.lightmap.data),
+                                        len(self.height_zones.data))]
+        pack_value(head, [self.name, self.default_start, self.world_pos])
+
+        tail = [pack_ints(chain.from_iterable(decos))]
+        for (x, y), zone in self.loading_zones.items():
+            pack_value(tail, [x, y, zone.target_level, zone.target_pos])
+        for (x, y), light in self.lightmap.items():
+            pack_value(tail, [x, y, light.diameter, light.red.astuple(), light.green.astuple(), light.blue.astuple(),
+                              light.blacklight])
+        for (x, y, z), zone in self.height_zones.items():
+            pack_value(tail, [x, y, z, zone.target_height, zone.target_render_offset])
+        return b"".join(head), b"".join(tail)
+
+    def writes_in_place(self, file):
+        """Whether saving the level to 'file' writes its edits into the file (see _write_binary_in_place), rather than
+        replacing it.  Not if the file is also mapped by another level (opened separately), whose unedited tiles would
+        change underneath it."""
+        tilemap = self.tilemap
+        return (isinstance(tilemap, MappedGrid) and split_compression(file)[0].endswith(self.binary_extension) and
+                tilemap.maps(file) and len(self._binary_sections()[0]) == tilemap.offset and
+                all(i.base.obj is tilemap.base.obj for i in MappedGrid._mapping(file)))
+
+    def _write_binary_in_place(self, file):
+        """Save a level whose tilemap is mapped from 'file' back into that file, where the tiles stay where they are
+        (see writes_in_place), writing only the edited rows of tiles and the sections around them.  This is not atomic,
+        so the bytes about to be overwritten are set aside first (see rollback_extension)."""
+        head, tail = self._binary_sections()
+        tilemap = self.tilemap
+        tail_start = tilemap.offset + 4 * tilemap.width * tilemap.height
+        with open(file, mode="rb") as f:
+            old_head = f.read(tilemap.offset)
+            f.seek(tail_start)
+            old_tail = f.read()
+        with atomic_write(file + self.rollback_extension, mode="wb") as f:
+            marshal.dump({"length": tail_start + len(old_tail), "head": old_head, "tail": old_tail,
+                          "tail_start": tail_start, "rows": tilemap.edited_row_contents()}, f)
+
+        try:
+            with open(file, mode="r+b") as f:
+                f.write(head)
+                tilemap.write_rows()
+                f.seek(tail_start)
+                f.write(tail)
                 try:
-                    # If the level was not found in project.json, use the value reported by the level file
-                    self.world_pos = data["world_pos"]
-                except KeyError:
-                    # No world position was found, default to [0, 0]
-                    self.world_pos = [0, 0]
-                    messagebox.showerror("Error", "No world_pos tag was found, defaulting to [0, 0]")
-        except KeyError as error:
-            messagebox.showerror("Error", f'Failed to load level, an issue was detected with \'{error}\'')
-            return False
-        return True
+                    f.truncate()
+                except OSError:
+                    # Windows will not cut off a file while it is mapped.  Readers ignore anything past the last record.
+                    pass
+                f.flush()
+                fsync(f.fileno())
+        except BaseException:
+            self.roll_back(file)
+            raise
+        remove(file + self.rollback_extension)
+
+    @classmethod
+    def roll_back(cls, file):
+        """Put a level file back as it was before an in-place save to it that did not finish, if there was one"""
+        rollback = file + cls.rollback_extension
+        if not path.exists(rollback):
+            return
+        with open(rollback, mode="rb") as f:
+            try:
+                saved = marshal.load(f)
+            except (EOFError, ValueError, TypeError) as error:
+                raise ValueError(f'{rollback} is corrupt ({error})') from error
+        with open(file, mode="r+b") as f:
+            f.write(saved["head"])
+            for position, data in saved["rows"].items():
+                f.seek(position)
+                f.write(data)
+            f.seek(saved["tail_start"])
+            f.write(saved["tail"])
+            try:
+                f.truncate(saved["length"])
+            except OSError:
+                # As in _write_binary_in_place
+                pass
+            f.flush()
+            fsync(f.fileno())
+        remove(rollback)
+
+    def load_from_file(self, file, warn=print):
+        """Load the level from a file, as JSON or binary depending on its extension, decompressing .gz and .xz files.
+        The tiles of very large (uncompressed) binary levels are mapped into memory instead of being read.
+        Raises OSError if the file cannot be read and ValueError if it is not a valid level; warn(message) is called
+        about problems that were worked around."""
+        name, module = split_compression(file)
+        if module is not None:
+            try:
+                with module.open(file, mode="rb") as f:
+                    data = f.read()
+            except (EOFError, lzma.LZMAError, zlib.error) as error:
+                raise ValueError(f'the file is corrupt ({error})') from error
+            if name.endswith(self.binary_extension):
+                return self.load_from_binary(data, warn=warn)
+            return self.load_from_json(json.loads(data), warn)
+        if file.endswith(self.binary_extension):
+            self.roll_back(file)
+            with open(file, mode="rb") as f:
+                header = f.read(self.binary_header.size)
+            if len(header) == self.binary_header.size and byteorder == "little":
+                width, height = self.binary_header.unpack(header)[2:4]
+                if width * height > config.mapped_threshold:
+                    return self.load_from_binary(MappedGrid.map_file(file), file, warn)
+            with open(file, mode="rb") as f:
+                return self.load_from_binary(f.read(), warn=warn)
+        with open(file, mode="r") as f:
+            return self.load_from_json(json.load(f), warn)
+
+    def save_to_file(self, file):
+        """Save the level to a file, as JSON or binary depending on its extension,
+        compressed if it ends in .gz or .xz"""
+        if self.writes_in_place(file):
+            self._write_binary_in_place(file)
+            return
+        # The file is about to be replaced, so any grid still mapping it (this level's included) has to let go of it
+        MappedGrid.release(file)
+        if split_compression(file)[0].endswith(self.binary_extension):
+            with atomic_write(file, mode="wb") as f:
+                self.write_binary(f)
+        else:
+            with atomic_write(file) as f:
+                self.write_json(f)
 
     def copy(self):
         """Return a copy of the level data"""
         result = Level()
         result.name = self.name
-        result.level_width = self.level_width
-        result.level_height = self.level_height
-        result.tilemap = []
-        for i in self.tilemap:
-            result.tilemap.append(i.copy())
-        result.collider = []
-        for i in self.collider:
-            result.collider.append(i.copy())
+        result.world_pos = self.world_pos.copy()
+        result.tilemap = self.tilemap.copy()
+        result.collider = self.collider.copy()
         result.decomap = self.decomap.copy()
         result.default_start = self.default_start.copy()
         result.lightmap = self.lightmap.copy()
@@ -3104,94 +3981,619 @@ class Level:
             raise ValueError("Size changes leave behind invalid width")
 
         if self.level_height + up + down < 11:
-            raise ValueError("Size changes leave behind invalid width")
+            raise ValueError("Size changes leave behind invalid height")
+
+        # Clear out everything that is about to be cut off through the regular (recorded) edits first, so that the
+        # resize itself loses nothing and can be undone by resizing back
+        width, height = self.level_width, self.level_height
+        x0, y0 = max(-left, 0), max(-up, 0)
+        x1, y1 = width - max(-right, 0), height - max(-down, 0)
+        for region in ((0, 0, x0, height), (x1, 0, width, height), (x0, 0, x1, y0), (x0, y1, x1, height)):
+            for x, y, value in list(self.tilemap.iter_cells(region)):
+                self.tilemap[x, y] = self.tilemap.default
+        for deco in list(self.decomap):
+            if not (x0 <= deco.x < x1 and y0 <= deco.y < y1):
+                self.decomap.remove(deco.x, deco.y, deco.deco_id)
+        for zones, scale in ((self.loading_zones, 1), (self.lightmap, 1), (self.height_zones, 2)):
+            for key in list(zones.data):
+                if not (x0 * scale <= key[0] < x1 * scale and y0 * scale <= key[1] < y1 * scale):
+                    zones.pop(key)
+
+        self.default_start = [min(max(self.default_start[0] + left, 0), width + left + right - 1),
+                              min(max(self.default_start[1] + up, 0), height + up + down - 1)]
+        self._resize(left, right, up, down)
+        if self.recorder is not None:
+            self.recorder.record(self, "size", (-left, -right, -up, -down), (left, right, up, down))
+
+    def _resize(self, left, right, up, down):
+        """Resize the grids and shift everything placed on the map along with the tiles"""
+        self.tilemap.resize(left, right, up, down)
+        self.collider.resize(left * 2, right * 2, up * 2, down * 2)
+
+        # Height zones are placed on the collider's half-tile grid
+        width, height = self.level_width, self.level_height
+        self.decomap.offset(left, up, width, height)
+        self.loading_zones.offset(left, up, width, height)
+        self.lightmap.offset(left, up, width, height)
+        self.height_zones.offset(left * 2, up * 2, width * 2, height * 2)
+
+    def json_data(self):
+        """Returns the level as plain JSON data"""
+        if config.rle_tilemap:
+            tilemap = ("tilemap_rle", [rle_encode(i) for i in self.tilemap.rows()])
+        else:
+            tilemap = ("tilemap", list(self.tilemap.rows()))
+        return {"format_version": self.format_version,
+                tilemap[0]: tilemap[1],
+                "decomap": self.decomap.jsonify(),
+                # "colliders": self.collider,
+                "loading_zones": self.loading_zones.jsonify(),
+                "lightmap": self.lightmap.jsonify(),
+                "height_zones": self.height_zones.jsonify(),
+                "spawn": self.default_start,
+                "world_pos": self.world_pos,
+                "name": self.name}
+
+    def write_json(self, f):
+        """Write the level's JSON representation to a text file, piece by piece"""
+        f.writelines(iter_json(self.json_data()))
+
+    def jsonify(self):
+        """Convert the level to a JSON representation"""
+        return "".join(iter_json(self.json_data()))
 
-        if left != 0:
-            if left > 0:
-                for i, j in enumerate(self.tilemap):
-                    for k in range(left):
-                        self.tilemap[i].insert(0, 0)
 
-                for i, j in enumerate(self.collider):
-                    for k in range(left):
-                        self.collider[i].insert(0, 0)
-                        self.collider[i].insert(0, 0)
-            else:
-                for i, j in enumerate(self.tilemap):
-                    for k in range(abs(left)):
-                        j.pop(0)
-
-                for i, j in enumerate(self.collider):
-                    for k in range(abs(left)):
-                        self.collider[i].pop(0)
-                        self.collider[i].pop(0)
-
-            self.level_width += left
-
-        if right != 0:
-            if right > 0:
-                for i, j in enumerate(self.tilemap):
-                    for k in range(right):
-                        self.tilemap[i].insert(-1, 0)
-                for i, j in enumerate(self.collider):
-                    for k in range(right):
-                        self.collider[i].insert(-1, 0)
-                        self.collider[i].insert(-1, 0)
+# Source of revision numbers.  Shared by all containers, so revisions only ever increase, even across containers.
+revision_counter = count(1)
+
+
+class RevisionTracked:
+    """Mixin for containers that keep a modification counter, as well as an order-independent hash of their entries.
+    The hash is only built once it is first asked for, and is kept up to date entry by entry from then on.  Edits are
+    also reported to the recorder, if one is attached (see EditHistory)."""
+
+    revision = 0
+    _content_hash = None
+    recorder = None
+    # Name of the level attribute holding the container, so that recorded edits can refer to it by name
+    name = None
+
+    def _entries(self):
+        """Iterate over the (hashable) entries of the container.  Override in subclass"""
+        return iter(())
+
+    @property
+    def content_hash(self):
+        """Hash of the container's entries"""
+        if self._content_hash is None:
+            self._content_hash = 0
+            for i in self._entries():
+                self._content_hash ^= hash(i)
+        return self._content_hash
+
+    def _touch(self, removed=(), added=()):
+        """Record a modification, given the entries it removed and added"""
+        self.revision = next(revision_counter)
+        if self._content_hash is not None:
+            for i in chain(removed, added):
+                self._content_hash ^= hash(i)
+
+    def _invalidate(self):
+        """Record a modification too broad to track entry by entry.  The hash is rebuilt when next asked for."""
+        self.revision = next(revision_counter)
+        self._content_hash = None
+
+    def restore(self, key, value):
+        """Undo/redo hook for EditHistory: put the entry 'key' back to 'value'.  Override in subclass"""
+        pass
+
+
+class Grid(RevisionTracked):
+    """Container structure for dense 2D level data, such as the tilemap and collider"""
+
+    # Data structure: [[value, ...], ...] (one list per row)
+    def __init__(self, width, height, default=0):
+        self.width = width
+        self.height = height
+        self.default = default
+        self.data = [[default] * width for i in range(height)]
+        # Indices of the rows shared with copies of the grid.  They are cloned before being written to.
+        self._shared_rows = set()
+
+    def __repr__(self):
+        return self.data.__repr__()
+
+    def __getitem__(self, key):
+        """Get the value at the coordinates x-y"""
+        x, y = key
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.data[y][x]
+        raise IndexError("'{}' is out of bounds!".format(key))
+
+    def __setitem__(self, key, value):
+        """Set the value at the coordinates x-y"""
+        x, y = key
+        if 0 <= x < self.width and 0 <= y < self.height:
+            old = self.data[y][x]
+            if old != value:
+                if y in self._shared_rows:
+                    self.data[y] = self.data[y].copy()
+                    self._shared_rows.discard(y)
+                self.data[y][x] = value
+                self._touch(((x, y, old),) if old != self.default else (),
+                            ((x, y, value),) if value != self.default else ())
+                if self.recorder is not None:
+                    self.recorder.record(self, (x, y), old, value)
+        else:
+            raise IndexError("'{}' is out of bounds!".format(key))
+
+    def _entries(self):
+        return self.iter_cells()
+
+    def restore(self, key, value):
+        self[key] = value
+
+    @classmethod
+    def from_rows(cls, rows, default=0):
+        """Create a grid from a list of rows.  The rows are adopted, not copied."""
+        result = cls(0, 0, default)
+        result.width = len(rows[0]) if rows else 0
+        result.height = len(rows)
+        result.data = rows
+        return result
+
+    def rows(self):
+        """Iterate over the rows of the grid, top to bottom"""
+        return iter(self.data)
+
+    def iter_cells(self, region=None, skip_default=True):
+        """Iterate over (x, y, value) for every cell, optionally restricted to the region (x0, y0, x1, y1) and
+        skipping cells holding the default value"""
+        x0, y0, x1, y1 = clip_region(region, self.width, self.height)
+        for y in range(y0, y1):
+            row = self.data[y]
+            if skip_default:
+                for x in compress(range(x0, x1), map(ne, row[x0:x1], repeat(self.default))):
+                    yield x, y, row[x]
             else:
-                for i in self.tilemap:
-                    for k in range(abs(right)):
-                        i.pop(-1)
-                for i in self.collider:
-                    i.pop(-1)
-                    i.pop(-1)
-
-            self.level_width += right
-
-        if up != 0:
-            if up > 0:
-                for i in range(up):
-                    self.tilemap.insert(0, [0] * self.level_width)
-                    self.collider.insert(0, [0] * self.level_width * 2)
-                    self.collider.insert(0, [0] * self.level_width * 2)
+                for x in range(x0, x1):
+                    yield x, y, row[x]
+
+    def fill(self, value):
+        """Set every cell to the given value"""
+        self.data = [[value] * self.width for i in range(self.height)]
+        self._shared_rows = set()
+        self._invalidate()
+
+    def copy(self):
+        """Returns a copy of the grid.  Rows are shared between the two until either one writes to them."""
+        result = Grid(0, 0, self.default)
+        result.width = self.width
+        result.height = self.height
+        result.data = list(self.data)
+        result._content_hash = self._content_hash
+        self._shared_rows = set(range(self.height))
+        result._shared_rows = set(range(self.height))
+        return result
+
+    def resize(self, left=0, right=0, up=0, down=0):
+        """Grow (positive) or shrink (negative) the grid from its edges"""
+        default = self.default
+        start, end = max(-left, 0), self.width - max(-right, 0)
+        pad_left, pad_right = [default] * max(left, 0), [default] * max(right, 0)
+        self.width += left + right
+
+        rows = [pad_left + row[start:end] + pad_right for row in self.data[max(-up, 0):self.height - max(-down, 0)]]
+        self.data = ([[default] * self.width for i in range(max(up, 0))] + rows +
+                     [[default] * self.width for i in range(max(down, 0))])
+        self.height += up + down
+        self._shared_rows = set()
+        self._invalidate()
+
+
+class ChunkedGrid(RevisionTracked):
+    """Container structure for sparse 2D level data.  The grid is split into square chunks, and only the chunks holding
+    something other than the default value are allocated, so mostly empty levels cost next to nothing."""
+
+    chunk_size = 64
+
+    # Data structure: {(chunk_x, chunk_y): array([value, ...]) (chunk_size * chunk_size values, row-major),...}
+    def __init__(self, width, height, default=0):
+        self.width = width
+        self.height = height
+        self.default = default
+        self.chunks = {}
+        # Keys of the chunks shared with copies of the grid.  They are cloned before being written to.
+        self._shared_chunks = set()
+
+    def __repr__(self):
+        return "ChunkedGrid({}x{}, {} chunks)".format(self.width, self.height, len(self.chunks))
+
+    def __getitem__(self, key):
+        """Get the value at the coordinates x-y"""
+        x, y = key
+        if 0 <= x < self.width and 0 <= y < self.height:
+            size = self.chunk_size
+            chunk = self.chunks.get((x // size, y // size))
+            if chunk is None:
+                return self.default
+            return chunk[y % size * size + x % size]
+        raise IndexError("'{}' is out of bounds!".format(key))
+
+    def __setitem__(self, key, value):
+        """Set the value at the coordinates x-y, allocating its chunk if needed"""
+        x, y = key
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise IndexError("'{}' is out of bounds!".format(key))
+        size = self.chunk_size
+        chunk = self.chunks.get((x // size, y // size))
+        if chunk is None:
+            if value == self.default:
+                return
+            chunk = self.chunks[x // size, y // size] = array('i', [self.default]) * (size * size)
+        old = chunk[y % size * size + x % size]
+        if old != value:
+            if (x // size, y // size) in self._shared_chunks:
+                chunk = self.chunks[x // size, y // size] = array('i', chunk)
+                self._shared_chunks.discard((x // size, y // size))
+            chunk[y % size * size + x % size] = value
+            self._touch(((x, y, old),) if old != self.default else (),
+                        ((x, y, value),) if value != self.default else ())
+            if self.recorder is not None:
+                self.recorder.record(self, (x, y), old, value)
+
+    def _entries(self):
+        return self.iter_cells()
+
+    def restore(self, key, value):
+        self[key] = value
+
+    @classmethod
+    def from_rows(cls, rows, default=0):
+        """Create a grid from a list of rows, a chunk at a time"""
+        result = cls(len(rows[0]) if rows else 0, len(rows), default)
+        size = result.chunk_size
+        blank = array('i', [default]) * (size * size)
+        for y in range(0, result.height, size):
+            band = rows[y:y + size]
+            for x in range(0, result.width, size):
+                chunk = array('i', blank)
+                for offset, row in enumerate(band):
+                    segment = row[x:x + size]
+                    chunk[offset * size:offset * size + len(segment)] = array('i', segment)
+                if chunk != blank:
+                    result.chunks[x // size, y // size] = chunk
+        result._invalidate()
+        return result
+
+    def iter_chunks(self, region=None):
+        """Iterate over ((chunk_x, chunk_y), chunk) for the allocated chunks, in row-major order, optionally restricted
+        to those overlapping the region (x0, y0, x1, y1)"""
+        x0, y0, x1, y1 = clip_region(region, self.width, self.height)
+        size = self.chunk_size
+        for (chunk_x, chunk_y) in sorted(self.chunks, key=lambda i: (i[1], i[0])):
+            if x0 < (chunk_x + 1) * size and chunk_x * size < x1 and y0 < (chunk_y + 1) * size and chunk_y * size < y1:
+                yield (chunk_x, chunk_y), self.chunks[chunk_x, chunk_y]
+
+    def rows(self):
+        """Iterate over the rows of the grid, top to bottom.  Rows are built on the fly."""
+        size = self.chunk_size
+        for y in range(self.height):
+            row = [self.default] * self.width
+            offset = y % size * size
+            for chunk_x in range((self.width + size - 1) // size):
+                chunk = self.chunks.get((chunk_x, y // size))
+                if chunk is not None:
+                    start = chunk_x * size
+                    end = min(start + size, self.width)
+                    row[start:end] = chunk[offset:offset + end - start]
+            yield row
+
+    def iter_cells(self, region=None, skip_default=True):
+        """Iterate over (x, y, value) for every cell, optionally restricted to the region (x0, y0, x1, y1) and
+        skipping cells holding the default value.  Only allocated chunks are visited when skipping defaults."""
+        x0, y0, x1, y1 = clip_region(region, self.width, self.height)
+        if not skip_default:
+            for y in range(y0, y1):
+                for x in range(x0, x1):
+                    yield x, y, self[x, y]
+            return
+
+        size = self.chunk_size
+        for (chunk_x, chunk_y), chunk in self.iter_chunks((x0, y0, x1, y1)):
+            for i in compress(range(size * size), map(ne, chunk, repeat(self.default))):
+                x = chunk_x * size + i % size
+                y = chunk_y * size + i // size
+                if x0 <= x < x1 and y0 <= y < y1:
+                    yield x, y, chunk[i]
+
+    def prune(self):
+        """Release chunks that only hold the default value"""
+        empty = array('i', [self.default]) * (self.chunk_size * self.chunk_size)
+        self.chunks = dict((i, j) for i, j in self.chunks.items() if j != empty)
+        self._shared_chunks &= self.chunks.keys()
+
+    def fill(self, value):
+        """Set every cell to the given value"""
+        self.chunks = {}
+        self._shared_chunks = set()
+        if value != self.default:
+            size = self.chunk_size
+            for chunk_y in range((self.height + size - 1) // size):
+                for chunk_x in range((self.width + size - 1) // size):
+                    self.chunks[chunk_x, chunk_y] = array('i', [value]) * (size * size)
+        self._invalidate()
+
+    def copy(self):
+        """Returns a copy of the grid.  Chunks are shared between the two until either one writes to them."""
+        result = ChunkedGrid(self.width, self.height, self.default)
+        result.chunks = self.chunks.copy()
+        result._content_hash = self._content_hash
+        self._shared_chunks = set(self.chunks)
+        result._shared_chunks = set(self.chunks)
+        return result
+
+    def resize(self, left=0, right=0, up=0, down=0):
+        """Grow (positive) or shrink (negative) the grid from its edges.  Chunks are moved a row slice at a time."""
+        size = self.chunk_size
+        old_chunks, old_width = self.chunks, self.width
+        self.width += left + right
+        self.height += up + down
+        self.chunks = {}
+        self._shared_chunks = set()
+        for (chunk_x, chunk_y), chunk in old_chunks.items():
+            x = chunk_x * size
+            run_length = min(size, old_width - x)
+            for offset in range(size):
+                y = chunk_y * size + offset + up
+                if 0 <= y < self.height:
+                    self._write_run(x + left, y, chunk[offset * size:offset * size + run_length])
+        self._invalidate()
+
+    def _write_run(self, x, y, values):
+        """Write a horizontal run of values starting at x-y, clipped to the grid.  Runs of default values do not
+        allocate chunks."""
+        if x < 0:
+            values, x = values[-x:], 0
+        values = values[:max(self.width - x, 0)]
+        size = self.chunk_size
+        while values:
+            count = min(size - x % size, len(values))
+            run, values = values[:count], values[count:]
+            chunk = self.chunks.get((x // size, y // size))
+            if chunk is None:
+                if all(i == self.default for i in run):
+                    x += count
+                    continue
+                chunk = self.chunks[x // size, y // size] = array('i', [self.default]) * (size * size)
+            start = y % size * size + x % size
+            chunk[start:start + count] = array('i', run)
+            x += count
+
+
+class MappedGrid(RevisionTracked):
+    """Container structure for the tilemap of a huge binary level, left in the level file and mapped into memory.  Only
+    the rows that have been written to are held as lists; the rest are read from the file as they are needed, so the
+    operating system only pages in the parts of the level that are actually used.  Saving the level back to the same
+    file writes the edited rows straight into the mapping."""
+
+    # Data structure: base: int32 view of the file ([value, ...], row-major), data: {y: [value, ...]} (edited rows)
+
+    # Every grid, so that they can all let go of a file before it is replaced (see release).  Levels are saved on
+    # another thread, hence the lock.
+    instances = weakref.WeakSet()
+    instances_lock = threading.Lock()
+
+    def __init__(self, base, width, height, default=0):
+        self.width = width
+        self.height = height
+        self.default = default
+        self.base = base
+        self.data = {}
+        # Rows shared with copies of the grid.  They are cloned before being written to.
+        self._shared_rows = set()
+        # The file the base is mapped from, where in it the tiles start, and whether the mapping can be written to
+        self.file = None
+        self.offset = 0
+        self.writable = False
+        with MappedGrid.instances_lock:
+            MappedGrid.instances.add(self)
+
+    def __repr__(self):
+        return "MappedGrid({}x{}, {} rows edited)".format(self.width, self.height, len(self.data))
+
+    @classmethod
+    def _mapping(cls, file):
+        """Returns the grids that still have their tiles in the given file"""
+        if not path.exists(file):
+            return []
+        with cls.instances_lock:
+            grids = list(cls.instances)
+        return [i for i in grids if i.base is not None and path.exists(i.file) and path.samefile(i.file, file)]
+
+    @classmethod
+    def is_mapped(cls, file):
+        """Whether any grid still has its tiles in the given file"""
+        return bool(cls._mapping(file))
+
+    @classmethod
+    def release(cls, file):
+        """Read the tiles of every grid mapped from the given file into memory and unmap it, so that the file can be
+        replaced (which Windows does not allow while it is mapped).  None of those grids may be in use on another
+        thread."""
+        bases = []
+        for grid in cls._mapping(file):
+            for y in range(grid.height):
+                if y not in grid.data:
+                    grid.data[y] = grid.base[y * grid.width:(y + 1) * grid.width].tolist()
+            bases.append(grid.base)
+            grid.base = None
+        mappings = {id(i.obj): i.obj for i in bases}
+        for base in bases:
+            base.release()
+        for mapping in mappings.values():
+            try:
+                mapping.close()
+            except BufferError:
+                # Still exported somewhere else.  It is closed once that lets go of it.
+                pass
+
+    @staticmethod
+    def map_file(file):
+        """Map a file into memory, for writing if possible"""
+        try:
+            with open(file, mode="r+b") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
+        except PermissionError:
+            with open(file, mode="rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def from_mapping(cls, mapping, offset, width, height, file, default=0):
+        """Create a grid from the little-endian int32 tiles at 'offset' in the memory map of 'file'"""
+        if offset + 4 * width * height > len(mapping):
+            raise ValueError("Truncated integer array")
+        result = cls(memoryview(mapping)[offset:offset + 4 * width * height].cast('i'), width, height, default)
+        result.file = file
+        result.offset = offset
+        result.writable = not memoryview(mapping).readonly
+        return result
+
+    def maps(self, file):
+        """Whether the grid's tiles are still those in the given file, and can be written back to it"""
+        return self.writable and self.base is not None and path.exists(file) and path.samefile(file, self.file)
+
+    def _row(self, y):
+        """Returns row y, as a list (not to be modified)"""
+        row = self.data.get(y)
+        if row is None:
+            return self.base[y * self.width:(y + 1) * self.width].tolist()
+        return row
+
+    def __getitem__(self, key):
+        """Get the value at the coordinates x-y"""
+        x, y = key
+        if 0 <= x < self.width and 0 <= y < self.height:
+            row = self.data.get(y)
+            if row is None:
+                return self.base[y * self.width + x]
+            return row[x]
+        raise IndexError("'{}' is out of bounds!".format(key))
+
+    def __setitem__(self, key, value):
+        """Set the value at the coordinates x-y, reading its row into memory first"""
+        x, y = key
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise IndexError("'{}' is out of bounds!".format(key))
+        old = self[x, y]
+        if old != value:
+            row = self.data.get(y)
+            if row is None or y in self._shared_rows:
+                row = self.data[y] = list(self._row(y))
+                self._shared_rows.discard(y)
+            row[x] = value
+            self._touch(((x, y, old),) if old != self.default else (),
+                        ((x, y, value),) if value != self.default else ())
+            if self.recorder is not None:
+                self.recorder.record(self, (x, y), old, value)
+
+    def _entries(self):
+        return self.iter_cells()
+
+    def restore(self, key, value):
+        self[key] = value
+
+    def rows(self):
+        """Iterate over the rows of the grid, top to bottom"""
+        return map(self._row, range(self.height))
+
+    def iter_cells(self, region=None, skip_default=True):
+        """Iterate over (x, y, value) for every cell, optionally restricted to the region (x0, y0, x1, y1) and
+        skipping cells holding the default value"""
+        x0, y0, x1, y1 = clip_region(region, self.width, self.height)
+        for y in range(y0, y1):
+            row = self.data.get(y)
+            if row is None:
+                row = self.base[y * self.width + x0:y * self.width + x1].tolist()
             else:
-                for i in range(abs(up)):
-                    self.tilemap.pop(0)
-                    self.collider.pop(0)
-                    self.collider.pop(0)
-            self.level_height += up
-
-        if down != 0:
-            if down > 0:
-                for i in range(down):
-                    self.tilemap.append([0] * self.level_width)
-                    self.collider.append([0] * self.level_width * 2)
-                    self.collider.append([0] * self.level_width * 2)
+                row = row[x0:x1]
+            if skip_default:
+                for x in compress(range(len(row)), map(ne, row, repeat(self.default))):
+                    yield x + x0, y, row[x]
             else:
-                for i in range(abs(down)):
-                    self.tilemap.pop(-1)
-                    self.collider.pop(-1)
-                    self.collider.pop(-1)
-            self.level_height += down
+                for x in range(len(row)):
+                    yield x + x0, y, row[x]
+
+    def edited_row_contents(self):
+        """Returns {position in the file: bytes} of the tiles write_rows would overwrite, as they are now"""
+        return {self.offset + 4 * y * self.width: self.base[y * self.width:(y + 1) * self.width].tobytes()
+                for y in self.data}
+
+    def write_rows(self):
+        """Write the edited rows into the mapped file"""
+        for y, row in self.data.items():
+            self.base[y * self.width:(y + 1) * self.width] = array('i', row)
+        self.base.obj.flush()
+
+    def fill(self, value):
+        """Set every cell to the given value.  The grid no longer refers to the file afterwards."""
+        self.data = {y: [value] * self.width for y in range(self.height)}
+        self.base = None
+        self._shared_rows = set()
+        self._invalidate()
 
-    def jsonify(self):
-        """Convert the level to a JSON representation"""
-        # Generate json string
-        result = json.dumps({"tilemap": self.tilemap,
-                             "decomap": self.decomap.jsonify(),
-                             # "colliders": self.collider,
-                             "loading_zones": self.loading_zones.jsonify(),
-                             "lightmap": self.lightmap.jsonify(),
-                             "height_zones": self.height_zones.jsonify(),
-                             "spawn": self.default_start,
-                             "world_pos": self.world_pos,
-                             "name": self.name}, indent=2)
-        # Format json string
-        result = re.sub(r'\s+([0-9.\-]+),', r'\1, ', result)
-        result = re.sub(r'\s+([0-9.\-]+)\s+\]', r' \1]', result)
-        result = re.sub(r':([0-9.\-]+)', r': \1', result)
+    def copy(self):
+        """Returns a copy of the grid, mapping the same file.  Edited rows are shared between the two until either one
+        writes to them."""
+        result = MappedGrid(self.base, self.width, self.height, self.default)
+        result.file, result.offset, result.writable = self.file, self.offset, self.writable
+        result.data = dict(self.data)
+        result._content_hash = self._content_hash
+        self._shared_rows = set(self.data)
+        result._shared_rows = set(self.data)
         return result
 
-
+    def resize(self, left=0, right=0, up=0, down=0):
+        """Grow (positive) or shrink (negative) the grid from its edges.  This reads in the whole grid, which no longer
+        refers to the file afterwards."""
+        default = self.default
+        start, end = max(-left, 0), self.width - max(-right, 0)
+        pad_left, pad_right = [default] * max(left, 0), [default] * max(right, 0)
+        rows = [pad_left + self._row(y)[start:end] + pad_right
+                for y in range(max(-up, 0), self.height - max(-down, 0))]
+        self.width += left + right
+        rows = [[default] * self.width for i in range(max(up, 0))] + rows + \
+               [[default] * self.width for i in range(max(down, 0))]
+        self.height += up + down
+        self.data = dict(enumerate(rows))
+        self.base = None
+        self._shared_rows = set()
+        self._invalidate()
+
+
+def clip_region(region, width, height):
+    """Clip the region (x0, y0, x1, y1) to a grid of the given size.  A region of None covers the whole grid."""
+    if region is None:
+        return 0, 0, width, height
+    x0, y0, x1, y1 = region
+    return max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+
+
+def slotted(cls):
+    """Rebuild a dataclass with __slots__ so its instances do not carry a per-instance __dict__.  (The 'slots'
+    argument of the dataclass decorator is not available before Python 3.10)"""
+    cls_dict = dict(cls.__dict__)
+    field_names = tuple(i.name for i in fields(cls))
+    cls_dict["__slots__"] = field_names
+    for name in field_names:
+        # Defaults are already baked into the generated __init__, so the class attributes can go
+        cls_dict.pop(name, None)
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
+@slotted
 @dataclass
 class Deco:
     """Data structure for decos.  deco_id: id representation of the deco,  x: x-position, y: y-position, height:
@@ -3205,13 +4607,25 @@ class Deco:
     def copy(self):
         return Deco(self.deco_id, self.x, self.y, self.height, self.render_offset)
 
+    def astuple(self):
+        """Return the deco as a tuple of its fields"""
+        return self.deco_id, self.x, self.y, self.height, self.render_offset
 
-class Decomap:
+    @classmethod
+    def fromtuple(cls, values):
+        """Create a deco from the output of astuple"""
+        return cls(*values)
+
+
+class Decomap(RevisionTracked):
     """Container structure for decomap data"""
 
     # Data structure: [Deco(id, x, y, height),...]
     def __init__(self):
         self.values = []
+        # Whether the list is shared with a copy of the decomap.  Decos are never modified in place, so only the list
+        # needs cloning before it is modified.
+        self._shared = False
 
     def __repr__(self):
         return self.values.__repr__()
@@ -3245,12 +4659,31 @@ class Decomap:
         """Returns an iterable version of the decomap"""
         return self.values.__iter__()
 
+    def _entries(self):
+        return map(Deco.astuple, self.values)
+
+    def restore(self, key, value):
+        """Undo/redo hook for EditHistory: put the deco 'key' (id, x, y) back to 'value' (a tuple of its fields, or
+        None if it should not exist)"""
+        deco_id, x, y = key
+        self.remove(x, y, deco_id)
+        if value is not None:
+            self.add(*value)
+
     def copy(self):
-        """Returns a copy of the decomap"""
+        """Returns a copy of the decomap.  The decos are shared between the two until either one is modified."""
         result = Decomap()
-        result.values = [i.copy() for i in self.values]
+        result.values = self.values
+        result._content_hash = self._content_hash
+        self._shared = result._shared = True
         return result
 
+    def _own(self):
+        """Stop sharing the list of decos with copies of the decomap"""
+        if self._shared:
+            self.values = list(self.values)
+            self._shared = False
+
     def add(self, deco_id, x, y, height, render_offset=0):
         """Add an item to the decomap"""
         already_exists = False
@@ -3260,23 +4693,85 @@ class Decomap:
                 break
 
         if not already_exists:
-            self.values.append(Deco(deco_id, x, y, height, render_offset))
+            deco = Deco(deco_id, x, y, height, render_offset)
+            self._own()
+            self.values.append(deco)
+            self._touch(added=(deco.astuple(),))
+            if self.recorder is not None:
+                self.recorder.record(self, (deco_id, x, y), None, deco.astuple())
+
+    def extend(self, records):
+        """Add (deco_id, x, y, height, render_offset) records in bulk, skipping those already in the decomap like add
+        does, but without searching the whole decomap for every one of them"""
+        records = [(deco_id, x, y, height, render_offset) for deco_id, x, y, height, render_offset in records]
+        present = {(i.deco_id, i.x, i.y) for i in self.values}
+        added = []
+        for record in records:
+            if record[:3] not in present:
+                present.add(record[:3])
+                added.append(record)
+        if added:
+            self._own()
+            self.values.extend(map(Deco.fromtuple, added))
+            self._touch(added=added)
+            if self.recorder is not None:
+                for i in added:
+                    self.recorder.record(self, i[:3], None, i)
 
     def remove(self, x, y, deco_id=None):
         """Remove all items at the coordinates x-y from the decomap"""
-        if deco_id:
-            self.values = [i for i in self.values if not (i.x == x and i.y == y and i.deco_id == deco_id)]
-        else:
-            self.values = [i for i in self.values if not (i.x == x and i.y == y)]
+        kept, removed = [], []
+        for i in self.values:
+            if i.x == x and i.y == y and (deco_id is None or i.deco_id == deco_id):
+                removed.append(i.astuple())
+            else:
+                kept.append(i)
+        if removed:
+            self.values = kept
+            self._shared = False
+            self._touch(removed=removed)
+            if self.recorder is not None:
+                for i in removed:
+                    self.recorder.record(self, i[:3], i, None)
 
     def set(self, x, y, deco_id, height, render_offset=0):
         """Remove all entries that have the given coordinates and append a new value with a given height"""
         self.remove(x, y)
-        self.add(x, y, deco_id, height, render_offset)
+        self.add(deco_id, x, y, height, render_offset)
+
+    def update(self, deco, height=None, render_offset=None):
+        """Change the height and/or render offset of the stored deco matching the given deco's id and coordinates"""
+        for index, i in enumerate(self.values):
+            if i.deco_id == deco.deco_id and i.x == deco.x and i.y == deco.y:
+                new = Deco(i.deco_id, i.x, i.y, i.height if height is None else height,
+                           i.render_offset if render_offset is None else render_offset)
+                if new != i:
+                    self._own()
+                    self.values[index] = new
+                    self._touch((i.astuple(),), (new.astuple(),))
+                    if self.recorder is not None:
+                        self.recorder.record(self, i.astuple()[:3], i.astuple(), new.astuple())
+                return
+
+    def filter_height(self, height):
+        """Returns the decos at the given height, or all of them if the height is 0"""
+        if not height:
+            return list(self.values)
+        return [i for i in self.values if i.height == height]
+
+    def offset(self, dx, dy, width, height):
+        """Shift every deco by dx-dy, dropping those that end up outside of a width x height map"""
+        values = [Deco(i.deco_id, i.x + dx, i.y + dy, i.height, i.render_offset) for i in self.values
+                  if 0 <= i.x + dx < width and 0 <= i.y + dy < height]
+        if dx or dy or len(values) != len(self.values):
+            self.values = values
+            self._shared = False
+            self._invalidate()
 
     def sort(self):
         """Sort the decomap elements in order of height + row + render_offset"""
         self.values = sorted(self.values, key=lambda x: x.height + x.y + x.render_offset)
+        self._shared = False
 
     def jsonify(self):
         """Convert the decomap into json format"""
@@ -3286,6 +4781,275 @@ class Decomap:
         return [[i.deco_id, i.x, i.y, i.height, i.render_offset] for i in self.values]
 
 
+class ColumnarDecomap(RevisionTracked):
+    """Container structure for decomap data, stored as parallel arrays rather than a list of Decos.  Offers the same
+    interface as Decomap, but filters, sorts and serializes in bulk (with NumPy, if it is available), which pays off on
+    decoration-heavy levels."""
+
+    # Data structure: deco_ids: [id,...], xs: [x,...], ys: [y,...], heights: [height,...], render_offsets: [offset,...]
+    def __init__(self):
+        self.deco_ids = array('i')
+        self.xs = array('i')
+        self.ys = array('i')
+        self.heights = array('i')
+        self.render_offsets = array('i')
+        # Whether the arrays are shared with a copy of the decomap.  They are cloned before being modified in place.
+        self._shared = False
+        # ((revision, height), [Deco, ...]) of the last filter_height
+        self._filtered = None
+
+    def __repr__(self):
+        return list(self).__repr__()
+
+    def __len__(self):
+        return len(self.deco_ids)
+
+    def __getitem__(self, key):
+        """Get a list of all entries with the given coordinates"""
+        if len(key) == 2 and all(type(i) == int for i in key):
+            result = [Deco(*self._row(i)) for i in self._indices_at(key[0], key[1])]
+            if len(result) == 0:
+                return None
+            else:
+                return result
+        else:
+            raise TypeError("'{}' is not a valid key!".format(key))
+
+    def __contains__(self, key):
+        """Check if decomap contains something at the coordinates x-y (deco-id is optional)"""
+        if len(key) == 2 and type(key[0]) == int and type(key[1]) == int:
+            return any(True for i in self._indices_at(key[0], key[1]))
+        elif len(key) == 3 and all([type(i) == int for i in key]):
+            return self._index_of(key[2], key[0], key[1]) is not None
+        else:
+            raise TypeError("'{}' is not a valid key!".format(key))
+
+    def __iter__(self):
+        """Returns an iterable version of the decomap"""
+        return map(Deco, self.deco_ids, self.xs, self.ys, self.heights, self.render_offsets)
+
+    def _entries(self):
+        return zip(*self.columns)
+
+    def restore(self, key, value):
+        """Undo/redo hook for EditHistory: put the deco 'key' (id, x, y) back to 'value' (a tuple of its fields, or
+        None if it should not exist)"""
+        deco_id, x, y = key
+        self.remove(x, y, deco_id)
+        if value is not None:
+            self.add(*value)
+
+    @property
+    def columns(self):
+        """The parallel arrays making up the decomap, in Deco field order"""
+        return self.deco_ids, self.xs, self.ys, self.heights, self.render_offsets
+
+    def _row(self, index):
+        """Returns the fields of the deco stored at the given index"""
+        return tuple(i[index] for i in self.columns)
+
+    def _touch(self, removed=(), added=()):
+        """Record a modification, given the entries it removed and added.  Entries can be removed from anywhere, but
+        have to have been added at the end, so that the decos kept by filter_height can be updated rather than built
+        all over again."""
+        revision = self.revision
+        super()._touch(removed, added)
+        if self._filtered is not None and self._filtered[0][0] == revision:
+            (_, height), decos = self._filtered
+            if removed:
+                removed = {i[:3] for i in removed}
+                decos = [i for i in decos if (i.deco_id, i.x, i.y) not in removed]
+            decos.extend(Deco(*i) for i in added if not height or i[3] == height)
+            self._filtered = (self.revision, height), decos
+
+    def _numpy_columns(self):
+        """The columns as NumPy arrays, sharing memory with them.  They are not to be kept, as the columns cannot be
+        resized while they exist."""
+        return [numpy.frombuffer(i, dtype=numpy.intc) for i in self.columns]
+
+    def _indices_at(self, x, y):
+        """Iterate over the indices of every deco at the coordinates x-y"""
+        if numpy is not None:
+            xs, ys = self._numpy_columns()[1:3]
+            return numpy.flatnonzero((xs == x) & (ys == y)).tolist()
+        return compress(range(len(self.xs)), map(eq, zip(self.xs, self.ys), repeat((x, y))))
+
+    def _index_of(self, deco_id, x, y):
+        """Returns the index of the given deco, or None if it is not in the decomap"""
+        for i in self._indices_at(x, y):
+            if self.deco_ids[i] == deco_id:
+                return i
+        return None
+
+    def _keep(self, selectors):
+        """Keep only the decos whose selector is true (selectors being a list, or a NumPy array of bools)"""
+        if numpy is not None:
+            columns = self._numpy_columns()
+            selectors = numpy.asarray(selectors, dtype=bool)
+            removed = list(zip(*(i[~selectors].tolist() for i in columns)))
+            if removed:
+                self.deco_ids, self.xs, self.ys, self.heights, self.render_offsets = (
+                    array('i', i[selectors].tobytes()) for i in columns)
+        else:
+            removed = [self._row(i) for i in compress(range(len(selectors)), map(not_, selectors))]
+            if removed:
+                self.deco_ids, self.xs, self.ys, self.heights, self.render_offsets = (
+                    array('i', compress(i, selectors)) for i in self.columns)
+        if removed:
+            self._shared = False
+            self._touch(removed=removed)
+            if self.recorder is not None:
+                for i in removed:
+                    self.recorder.record(self, i[:3], i, None)
+
+    @classmethod
+    def from_decos(cls, decos):
+        """Build a columnar decomap from an iterable of Decos (such as a Decomap)"""
+        result = cls()
+        for deco in decos:
+            result.add(deco.deco_id, deco.x, deco.y, deco.height, deco.render_offset)
+        return result
+
+    def copy(self):
+        """Returns a copy of the decomap.  The arrays are shared between the two until either one is modified."""
+        result = ColumnarDecomap()
+        result.deco_ids, result.xs, result.ys, result.heights, result.render_offsets = self.columns
+        result._content_hash = self._content_hash
+        self._shared = result._shared = True
+        return result
+
+    def _own(self):
+        """Stop sharing the arrays with copies of the decomap"""
+        if self._shared:
+            self.deco_ids, self.xs, self.ys, self.heights, self.render_offsets = (array('i', i) for i in self.columns)
+            self._shared = False
+
+    def add(self, deco_id, x, y, height, render_offset=0):
+        """Add an item to the decomap"""
+        if self._index_of(deco_id, x, y) is None:
+            self._own()
+            for column, value in zip(self.columns, (deco_id, x, y, height, render_offset)):
+                column.append(value)
+            self._touch(added=((deco_id, x, y, height, render_offset),))
+            if self.recorder is not None:
+                self.recorder.record(self, (deco_id, x, y), None, (deco_id, x, y, height, render_offset))
+
+    def extend(self, records):
+        """Add (deco_id, x, y, height, render_offset) records in bulk, skipping those already in the decomap like add
+        does, but without searching the whole decomap for every one of them"""
+        records = [(deco_id, x, y, height, render_offset) for deco_id, x, y, height, render_offset in records]
+        present = set(zip(self.deco_ids, self.xs, self.ys))
+        added = []
+        for record in records:
+            if record[:3] not in present:
+                present.add(record[:3])
+                added.append(record)
+        if added:
+            self._own()
+            for column, values in zip(self.columns, zip(*added)):
+                column.extend(values)
+            self._touch(added=added)
+            if self.recorder is not None:
+                for i in added:
+                    self.recorder.record(self, i[:3], None, i)
+
+    def remove(self, x, y, deco_id=None):
+        """Remove all items at the coordinates x-y from the decomap"""
+        if numpy is not None:
+            deco_ids, xs, ys = self._numpy_columns()[:3]
+            selectors = (xs != x) | (ys != y)
+            if deco_id is not None:
+                selectors |= deco_ids != deco_id
+            self._keep(selectors)
+        elif deco_id is not None:
+            self._keep([not (i == deco_id and j == x and k == y) for i, j, k in zip(self.deco_ids, self.xs, self.ys)])
+        else:
+            self._keep(list(map(lambda i: i != (x, y), zip(self.xs, self.ys))))
+
+    def set(self, x, y, deco_id, height, render_offset=0):
+        """Remove all entries that have the given coordinates and append a new value with a given height"""
+        self.remove(x, y)
+        self.add(deco_id, x, y, height, render_offset)
+
+    def update(self, deco, height=None, render_offset=None):
+        """Change the height and/or render offset of the stored deco matching the given deco's id and coordinates"""
+        index = self._index_of(deco.deco_id, deco.x, deco.y)
+        if index is None:
+            return
+        old = self._row(index)
+        self._own()
+        if height is not None:
+            self.heights[index] = height
+        if render_offset is not None:
+            self.render_offsets[index] = render_offset
+        if self._row(index) != old:
+            # The deco stays where it is, rather than moving to the end (see _touch)
+            self._filtered = None
+            self._touch((old,), (self._row(index),))
+            if self.recorder is not None:
+                self.recorder.record(self, old[:3], old, self._row(index))
+
+    def filter_height(self, height):
+        """Returns the decos at the given height, or all of them if the height is 0.  The views ask for the same height
+        every time they are redrawn, so the decos last returned are kept until the decomap changes."""
+        key = self.revision, height
+        if self._filtered is None or self._filtered[0] != key:
+            if numpy is not None:
+                columns = self._numpy_columns()
+                if height:
+                    selectors = columns[3] == height
+                    columns = [i[selectors] for i in columns]
+                decos = list(map(Deco, *(i.tolist() for i in columns)))
+            elif height:
+                selectors = list(map(eq, self.heights, repeat(height)))
+                decos = list(map(Deco, *(compress(i, selectors) for i in self.columns)))
+            else:
+                decos = list(self)
+            self._filtered = key, decos
+        return list(self._filtered[1])
+
+    def offset(self, dx, dy, width, height):
+        """Shift every deco by dx-dy, dropping those that end up outside of a width x height map"""
+        if dx or dy:
+            self.xs = array('i', map(add, self.xs, repeat(dx)))
+            self.ys = array('i', map(add, self.ys, repeat(dy)))
+        selectors = [0 <= x < width and 0 <= y < height for x, y in zip(self.xs, self.ys)]
+        if dx or dy or not all(selectors):
+            self.deco_ids, self.xs, self.ys, self.heights, self.render_offsets = (
+                array('i', compress(i, selectors)) for i in self.columns)
+            self._shared = False
+            self._invalidate()
+
+    def sort(self):
+        """Sort the decomap elements in order of height + row + render_offset.  Decos with equal keys keep their order,
+        and a decomap that is already sorted (as it is after being saved once) is left as it is."""
+        if numpy is not None:
+            columns = self._numpy_columns()
+            keys = columns[3].astype(numpy.int64) + columns[2] + columns[4]
+            if (keys[1:] >= keys[:-1]).all():
+                return
+            order = numpy.argsort(keys, kind="stable")
+            columns = [array('i', i[order].tobytes()) for i in columns]
+        else:
+            keys = list(map(add, map(add, self.heights, self.ys), self.render_offsets))
+            if all(map(le, keys, islice(keys, 1, None))):
+                return
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            columns = [array('i', map(i.__getitem__, order)) for i in self.columns]
+        self.deco_ids, self.xs, self.ys, self.heights, self.render_offsets = columns
+        self._shared = False
+        self._filtered = None
+
+    def jsonify(self):
+        """Convert the decomap into json format"""
+        # Ensure decomap is properly sorted
+        self.sort()
+        if numpy is not None:
+            return numpy.stack(self._numpy_columns(), axis=1).tolist()
+        return list(map(list, zip(*self.columns)))
+
+
+@slotted
 @dataclass
 class LoadingZone:
     """Data structure for loading zones"""
@@ -3296,7 +5060,17 @@ class LoadingZone:
         """Return a copy of the loading zone"""
         return LoadingZone(self.target_level, self.target_pos.copy())
 
+    def astuple(self):
+        """Return the loading zone as a (hashable) tuple of its fields"""
+        return self.target_level, tuple(self.target_pos)
+
+    @classmethod
+    def fromtuple(cls, values):
+        """Create a loading zone from the output of astuple"""
+        return cls(values[0], list(values[1]))
+
 
+@slotted
 @dataclass
 class HeightZone:
     """Data structure for loading zones"""
@@ -3307,7 +5081,17 @@ class HeightZone:
         """Return a copy of the loading zone"""
         return HeightZone(self.target_height, self.target_render_offset)
 
+    def astuple(self):
+        """Return the height zone as a tuple of its fields"""
+        return self.target_height, self.target_render_offset
 
+    @classmethod
+    def fromtuple(cls, values):
+        """Create a height zone from the output of astuple"""
+        return cls(*values)
+
+
+@slotted
 @dataclass
 class ColorFade:
     """Data structure for color fading data present in lights"""
@@ -3319,11 +5103,23 @@ class ColorFade:
         """Return a copy of the ColorFade"""
         return ColorFade(self.amplitude, self.inner_diameter, self.outer_diameter)
 
+    def astuple(self):
+        """Return the ColorFade as a tuple of its fields"""
+        return self.amplitude, self.inner_diameter, self.outer_diameter
+
+    @classmethod
+    def fromtuple(cls, values):
+        """Create a ColorFade from the output of astuple"""
+        return cls(*values)
+
     def jsonify(self):
         """Return a dictionary representation ready for use in a JSON tag"""
-        return self.copy().__dict__
+        return {"amplitude": self.amplitude,
+                "inner_diameter": self.inner_diameter,
+                "outer_diameter": self.outer_diameter}
 
 
+@slotted
 @dataclass
 class Light:
     """Data structure for lights"""
@@ -3343,17 +5139,42 @@ class Light:
                      self.blacklight,
                      self.active)
 
+    def astuple(self):
+        """Return the light as a (hashable) tuple of its fields"""
+        return (self.diameter, self.red.astuple(), self.green.astuple(), self.blue.astuple(), self.blacklight,
+                self.active)
+
+    @classmethod
+    def fromtuple(cls, values):
+        """Create a light from the output of astuple"""
+        return cls(values[0], ColorFade.fromtuple(values[1]), ColorFade.fromtuple(values[2]),
+                   ColorFade.fromtuple(values[3]), values[4], values[5])
 
-class CoordinateDict:
+
+class CoordinateDict(RevisionTracked):
     """Data structure for dictionaries where the key MUST be a pair of coordinates"""
 
     def __init__(self):
         super().__init__()
         self.data = {}
+        # Whether the dictionary is shared with a copy.  Values are never modified in place, so only the dictionary
+        # needs cloning before it is modified.
+        self._shared = False
 
     def __repr__(self):
         return self.data.__repr__()
 
+    @classmethod
+    def from_entries(cls, entries):
+        """Create a dictionary from (key, value) pairs in one go, rather than entry by entry"""
+        result = cls()
+        result.data = dict(entries)
+        if not all(map(result.check_key, result.data)):
+            raise TypeError("Invalid key in {}".format(cls.__name__))
+        if not all(map(result.check_type, result.data.values())):
+            raise TypeError("Invalid value in {}".format(cls.__name__))
+        return result
+
     def __getitem__(self, key):
         """Obtain the entry given by 'key'"""
         if self.check_key(key):
@@ -3365,7 +5186,12 @@ class CoordinateDict:
         """Modify/create the loading zone given by 'key'"""
         if self.check_key(key):
             if self.check_type(value):
+                old = self.data.get(key)
+                self._own()
                 self.data[key] = value
+                self._touch(((key, old.astuple()),) if old is not None else (), ((key, value.astuple()),))
+                if self.recorder is not None:
+                    self.recorder.record(self, key, old, value)
             else:
                 raise TypeError("'{}' is not a valid value!".format(value))
         else:
@@ -3390,11 +5216,48 @@ class CoordinateDict:
 
     def pop(self, key):
         """Remove the loading zone given by 'key'"""
-        return self.data.pop(key)
+        self._own()
+        value = self.data.pop(key)
+        self._touch(removed=((key, value.astuple()),))
+        if self.recorder is not None:
+            self.recorder.record(self, key, value, None)
+        return value
 
     def items(self):
         return self.data.items()
 
+    def offset(self, dx, dy, width, height):
+        """Shift the x-y part of every key by dx-dy, dropping entries that end up outside of a width x height map"""
+        data = dict(((i[0] + dx, i[1] + dy) + i[2:], j) for i, j in self.data.items()
+                    if 0 <= i[0] + dx < width and 0 <= i[1] + dy < height)
+        if dx or dy or len(data) != len(self.data):
+            self.data = data
+            self._shared = False
+            self._invalidate()
+
+    def _own(self):
+        """Stop sharing the dictionary with copies"""
+        if self._shared:
+            self.data = self.data.copy()
+            self._shared = False
+
+    def _copy_to(self, result):
+        """Share the dictionary (and hash) with a freshly created copy"""
+        result.data = self.data
+        result._content_hash = self._content_hash
+        self._shared = result._shared = True
+        return result
+
+    def _entries(self):
+        return ((i, j.astuple()) for i, j in self.data.items())
+
+    def restore(self, key, value):
+        """Undo/redo hook for EditHistory: put the entry 'key' back to 'value' (None if it should not exist)"""
+        if value is not None:
+            self[key] = value
+        elif key in self.data:
+            self.pop(key)
+
     def jsonify(self):
         """Convert into a list representation reading for use in a JSON tag.  Override in subclass"""
         pass
@@ -3413,9 +5276,7 @@ class LoadingZoneDict(CoordinateDict):
 
     def copy(self):
         """Return a new copy of the loading zone dictionary"""
-        result = LoadingZoneDict()
-        result.data = self.data.copy()
-        return result
+        return self._copy_to(LoadingZoneDict())
 
     def jsonify(self):
         """Convert into a list representation for use in a JSON tag"""
@@ -3456,9 +5317,7 @@ class HeightZoneDict(CoordinateDict):
 
     def copy(self):
         """Return a new copy of the height zone dictionary"""
-        result = HeightZoneDict()
-        result.data = self.data.copy()
-        return result
+        return self._copy_to(HeightZoneDict())
 
     def jsonify(self):
         """Convert into a list representation for use in a JSON tag"""
@@ -3494,9 +5353,7 @@ class LightmapDict(CoordinateDict):
 
     def copy(self):
         """Return a new copy of the lightmap dictionary"""
-        result = LightmapDict()
-        result.data = self.data.copy()
-        return result
+        return self._copy_to(LightmapDict())
 
     def jsonify(self):
         """Convert into a list representation for use in a JSON tag"""
@@ -3511,6 +5368,502 @@ class LightmapDict(CoordinateDict):
         return result
 
 
+class EditHistory:
+    """Undo/redo log for a level.  Instead of snapshots of the whole level, it keeps the edits themselves, as reported
+    by the level and its containers: (container, key, old value, new value).  Edits are grouped into transactions,
+    one per undo step, and repeated edits to the same entry within a transaction are merged.
+
+    Memory is kept within the budgets in the config: all but the most recent steps are compressed, and the oldest
+    steps are dropped once a history (or all of them together) grows past its budget."""
+
+    # Every live history, for enforcing the global budget
+    instances = weakref.WeakSet()
+    # Source of step numbers, shared between histories so that their steps can be ordered by age
+    step_counter = count()
+    # Rough memory cost of a single uncompressed change, in bytes
+    change_size = 200
+
+    def __init__(self):
+        # Steps: [(step number, estimated size, [change,...] or compressed bytes),...], oldest first
+        self.past = []
+        self.future = []
+        self.current = {}
+        self.level = None
+        self.journal = None
+        # LiveMinimap to tell about the edits of each transaction, undo and redo
+        self.minimap = None
+        self.memory = 0
+        # Bumped on resizes, since coordinates before and after a resize do not refer to the same entries
+        self.epoch = 0
+        self.applying = False
+        EditHistory.instances.add(self)
+
+    def attach(self, level):
+        """Start recording the edits made to the level, forgetting any earlier history"""
+        self.clear()
+        self.level = level
+        level.recorder = self
+
+    def detach(self, level):
+        """Stop recording the edits made to the level"""
+        level.recorder = None
+
+    def clear(self):
+        """Forget all recorded edits"""
+        self.past = []
+        self.future = []
+        self.current = {}
+        self.memory = 0
+
+    def record(self, container, key, old, new):
+        """Recorder hook, called by the level and its containers whenever they change"""
+        if self.applying:
+            return
+        if key == "size":
+            self.epoch += 1
+        entry = self.current.get((id(container), key, self.epoch))
+        if entry is None:
+            self.current[id(container), key, self.epoch] = [container, key, old, new]
+        else:
+            entry[3] = new
+
+    def begin(self):
+        """Open a new transaction, closing the current one"""
+        self.commit()
+
+    def commit(self):
+        """Close the current transaction.  Returns whether it changed anything (and so became an undo step)."""
+        changes = [i for i in self.current.values() if i[2] != i[3]]
+        self.current = {}
+        if not changes:
+            return False
+        self.memory -= sum(i[1] for i in self.future)
+        self.future = []
+        if self.journal is not None:
+            self.journal.append(self.level, [(container, key, new) for container, key, old, new in changes])
+        if self.minimap is not None:
+            self.minimap.update([(container, key, new) for container, key, old, new in changes])
+        self._push(self.past, changes)
+        self._compress_cold()
+        self._enforce_budgets()
+        return True
+
+    def undo(self):
+        """Revert the last transaction.  Returns whether there was one."""
+        self.commit()
+        if not self.past:
+            return False
+        changes = self._pop(self.past)
+        self._apply([(container, key, old) for container, key, old, new in reversed(changes)])
+        self._push(self.future, changes)
+        return True
+
+    def redo(self):
+        """Reapply the last reverted transaction.  Returns whether there was one."""
+        self.commit()
+        if not self.future:
+            return False
+        changes = self._pop(self.future)
+        self._apply([(container, key, new) for container, key, old, new in changes])
+        self._push(self.past, changes)
+        self._compress_cold()
+        return True
+
+    def _apply(self, changes):
+        """Apply (container, key, value) changes without recording them (other than in the journal and minimap)"""
+        if self.journal is not None:
+            self.journal.append(self.level, changes)
+        self.applying = True
+        try:
+            for container, key, value in changes:
+                container.restore(key, value)
+        finally:
+            self.applying = False
+        if self.minimap is not None:
+            self.minimap.update(changes)
+
+    def pending(self):
+        """Returns the (container, key, new value) changes made in the open transaction so far"""
+        return [(container, key, new) for container, key, old, new in self.current.values() if old != new]
+
+    def _push(self, steps, changes):
+        """Add an uncompressed step to the end of the given list of steps"""
+        size = len(changes) * self.change_size
+        steps.append((next(self.step_counter), size, changes))
+        self.memory += size
+
+    def _pop(self, steps):
+        """Remove the last step from the given list of steps, returning its changes"""
+        number, size, data = steps.pop()
+        self.memory -= size
+        return self._decompress(data) if isinstance(data, bytes) else data
+
+    def _compress_cold(self):
+        """Compress the steps that are no longer among the most recent ones"""
+        for i in range(len(self.past) - config.undo_uncompressed_steps):
+            number, size, data = self.past[i]
+            if not isinstance(data, bytes):
+                compressed = self._compress(data)
+                if compressed is not None:
+                    self.past[i] = (number, len(compressed), compressed)
+                    self.memory += len(compressed) - size
+
+    def _enforce_budgets(self):
+        """Drop the oldest steps until this history, and all of them together, fit in their budgets"""
+        while self.memory > config.undo_memory_per_view and len(self.past) + len(self.future) > 1:
+            self._drop_oldest()
+
+        histories = list(EditHistory.instances)
+        total = sum(i.memory for i in histories)
+        while total > config.undo_memory_total:
+            candidates = [i for i in histories if len(i.past) + len(i.future) > 1]
+            if not candidates:
+                break
+            oldest = min(candidates, key=lambda i: (i.past or i.future)[0][0])
+            total -= oldest._drop_oldest()
+
+    def _drop_oldest(self):
+        """Drop the oldest undo step (or the furthest redo step, if there is nothing left to undo).  Returns the memory
+        freed."""
+        number, size, data = (self.past or self.future).pop(0)
+        self.memory -= size
+        return size
+
+    def _compress(self, changes):
+        """Encode a transaction as compressed marshal data.  Returns None if it holds something that cannot be encoded,
+        such as a whole container."""
+        try:
+            encoded = [(None if container is self.level else container.name, key, self._encode(old), self._encode(new))
+                       for container, key, old, new in changes]
+            return zlib.compress(marshal.dumps(encoded))
+        except ValueError:
+            return None
+
+    def _decompress(self, data):
+        """Decode a transaction encoded by _compress"""
+        return [[self.level if name is None else getattr(self.level, name), key, self._decode(old), self._decode(new)]
+                for name, key, old, new in marshal.loads(zlib.decompress(data))]
+
+    @staticmethod
+    def _encode(value):
+        """Encode a recorded value as (record type, fields) or (None, value)"""
+        if isinstance(value, RevisionTracked):
+            raise ValueError("Containers cannot be encoded")
+        if hasattr(value, "astuple"):
+            return type(value).__name__, value.astuple()
+        return None, value
+
+    @staticmethod
+    def _decode(value):
+        """Decode a value encoded by _encode"""
+        record_type, value = value
+        if record_type is None:
+            return value
+        return {"Deco": Deco, "LoadingZone": LoadingZone, "HeightZone": HeightZone, "Light": Light}[
+            record_type].fromtuple(value)
+
+
+class Journal:
+    """Append-only log of the edits made to a level since it was last saved, so that unsaved work can be recovered if
+    the editor goes down.  Edits are encoded on the caller's thread and written out by a background thread, which
+    flushes whenever it runs out of work.  Saving compacts the journal back down to just its header.
+
+    A journal file is a series of records, each a 4-byte length followed by marshal data.  The first record is the
+    header, {"base": path of the saved level or None}; every other one is a list of (container name, key, value)
+    changes to apply in order, where the container name is None for the level itself."""
+
+    directory = "journal"
+    # Every live journal, so that their files are not mistaken for leftovers and can be finished off on exit
+    instances = weakref.WeakSet()
+
+    def __init__(self):
+        # Named at random, since a later session (after a reboot, say) may well get the same process id
+        self.path = path.join(self.directory, uuid.uuid4().hex + ".wbj")
+        # Held locked for as long as the journal is live, so that other instances of the editor running at the same
+        # time do not take it for a leftover
+        self.lock = None
+        try:
+            makedirs(self.directory, exist_ok=True)
+            self.lock = open(self._lock_path(self.path), mode="wb")
+            self._lock(self.lock)
+        except OSError as e:
+            print("Could not lock journal {}: {}".format(self.path, e))
+        # Set when an edit could not be journaled, until the next save makes the journal usable again
+        self.broken = False
+        # Number of change records appended so far, and of resets and breaks, for checkpoints
+        self.total = 0
+        self.generation = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+        Journal.instances.add(self)
+
+    def reset(self, base, data=b""):
+        """Start over from a level saved at base (or a new level, if None), followed by the already encoded change
+        records in data"""
+        self.broken = False
+        self.generation += 1
+        self.queue.put(("open", (self._frame(marshal.dumps({"base": base})) + data, self.total)))
+
+    def append(self, level, changes):
+        """Queue (container, key, value) changes made to the level for writing"""
+        if self.broken:
+            return
+        try:
+            data = marshal.dumps([(None if container is level else container.name, key, EditHistory._encode(value))
+                                  for container, key, value in changes])
+        except ValueError:
+            # Replaying the rest of the journal would not reproduce the level, so it is better to have none at all
+            self.broken = True
+            self.generation += 1
+            self.queue.put(("delete", None))
+            return
+        self.total += 1
+        self.queue.put(("append", self._frame(data)))
+
+    def checkpoint(self):
+        """Returns a marker for the current end of the journal, for compact()"""
+        return self.generation, self.total
+
+    def compact(self, checkpoint, base):
+        """Drop the records written before the checkpoint, now that the level as it was then has been saved at base.
+        May be called from the save worker's thread."""
+        generation, mark = checkpoint
+        if generation == self.generation and not self.broken:
+            self.queue.put(("compact", (self._frame(marshal.dumps({"base": base})), mark)))
+
+    def close(self):
+        """Delete the journal, once its level has been saved or deliberately discarded"""
+        self.queue.put(("delete", None))
+        self.queue.put(("stop", None))
+        Journal.instances.discard(self)
+
+    @classmethod
+    def shutdown(cls):
+        """Wait for every journal to finish writing, keeping the files for recovery"""
+        journals = list(cls.instances)
+        for i in journals:
+            i.queue.put(("stop", None))
+        for i in journals:
+            i.thread.join()
+
+    @classmethod
+    def leftovers(cls):
+        """Returns the journal files not belonging to any open view, here or in another instance of the editor, i.e.
+        those left behind by an earlier session"""
+        if not path.isdir(cls.directory):
+            return []
+        in_use = {i.path for i in cls.instances}
+        files = [path.join(cls.directory, i) for i in sorted(listdir(cls.directory)) if i.endswith(".wbj")]
+        return [i for i in files if i not in in_use and not cls._locked(i)]
+
+    @staticmethod
+    def _lock_path(file):
+        """Returns the path of the lock file of a journal"""
+        return path.splitext(file)[0] + ".lock"
+
+    @classmethod
+    def _locked(cls, file):
+        """Whether a journal is locked by another process.  A lock file that is no longer locked is removed."""
+        lock_path = cls._lock_path(file)
+        try:
+            with open(lock_path, mode="r+b") as f:
+                try:
+                    cls._lock(f)
+                except OSError:
+                    return True
+                cls._unlock(f)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            return True
+        try:
+            remove(lock_path)
+        except OSError:
+            pass
+        return False
+
+    @staticmethod
+    def _lock(f):
+        """Lock an open file for this process, raising OSError if another one holds the lock"""
+        if platform == 'win32':
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    @staticmethod
+    def _unlock(f):
+        """Release the lock taken by _lock"""
+        if platform == 'win32':
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _release_lock(self):
+        """Unlock and remove the journal's lock file, once the journal is no longer written to"""
+        if self.lock is None:
+            return
+        try:
+            self._unlock(self.lock)
+        except OSError:
+            pass
+        self.lock.close()
+        self.lock = None
+        try:
+            remove(self._lock_path(self.path))
+        except OSError:
+            pass
+
+    @staticmethod
+    def read(file):
+        """Read a journal file, ignoring a partly written record at the end.  Returns (base path, [changes,...], the
+        raw bytes of the change records)."""
+        with open(file, mode="rb") as f:
+            data = f.read()
+        records = []
+        start = position = 0
+        while position + 4 <= len(data):
+            length, = struct.unpack_from("<I", data, position)
+            if position + 4 + length > len(data):
+                break
+            try:
+                records.append(marshal.loads(data[position + 4:position + 4 + length]))
+            except (EOFError, ValueError, TypeError):
+                break
+            position += 4 + length
+            if len(records) == 1:
+                start = position
+        if not records or not isinstance(records[0], dict):
+            return None, [], b""
+        return records[0].get("base"), records[1:], data[start:position]
+
+    @staticmethod
+    def _frame(data):
+        """Prefix a record with its length"""
+        return struct.pack("<I", len(data)) + data
+
+    def _write_loop(self):
+        """Writer thread: carries out the queued operations on the journal file"""
+        f = None
+        # The file holds a header (and possibly recovered records), followed by the appended records, the first of
+        # which is record number 'first'
+        header_size = 0
+        sizes = []
+        first = 0
+        while True:
+            action, data = self.queue.get()
+            if action in ("open", "delete", "stop") and f is not None:
+                f.close()
+                f = None
+            if action == "stop":
+                self._release_lock()
+                return
+            try:
+                if action == "open":
+                    header, first = data
+                    makedirs(self.directory, exist_ok=True)
+                    f = open(self.path, mode="wb")
+                    f.write(header)
+                    header_size = len(header)
+                    sizes = []
+                elif action == "delete":
+                    if path.exists(self.path):
+                        remove(self.path)
+                elif action == "append" and f is not None:
+                    f.write(data)
+                    sizes.append(len(data))
+                elif action == "compact" and f is not None:
+                    header, mark = data
+                    dropped = max(0, min(len(sizes), mark - first))
+                    f.close()
+                    f = None
+                    with open(self.path, mode="rb") as old:
+                        old.seek(header_size + sum(sizes[:dropped]))
+                        kept = old.read()
+                    with atomic_write(self.path, mode="wb") as new:
+                        new.write(header + kept)
+                    f = open(self.path, mode="ab")
+                    header_size = len(header)
+                    sizes = sizes[dropped:]
+                    first += dropped
+
+                # Flush once the backlog has been written, rather than after every record
+                if f is not None and self.queue.empty():
+                    f.flush()
+                    fsync(f.fileno())
+            except OSError as e:
+                print("Could not write journal {}: {}".format(self.path, e))
+                if f is not None:
+                    f.close()
+                    f = None
+
+
+class BackgroundWorker:
+    """Runs jobs on a background thread, one at a time and in the order they were submitted.  Their results (or
+    errors) are handed back to callbacks on the Tk thread, which polls for them while jobs are outstanding."""
+
+    # Milliseconds between polls for finished jobs
+    poll_interval = 50
+    instances = weakref.WeakSet()
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.pending = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        BackgroundWorker.instances.add(self)
+
+    def submit(self, job, on_done=None, on_error=None):
+        """Queue job() to be run.  on_done(result) or on_error(exception) is called on the Tk thread afterwards."""
+        self.pending += 1
+        self.jobs.put((job, on_done, on_error))
+        if self.pending == 1:
+            self.widget.after(self.poll_interval, self._poll)
+
+    def wait(self):
+        """Block until every submitted job has run.  Their callbacks are not called."""
+        self.jobs.join()
+
+    @classmethod
+    def wait_all(cls):
+        """Block until every worker has finished its jobs"""
+        for i in list(cls.instances):
+            i.wait()
+
+    def _run(self):
+        """Worker thread"""
+        while True:
+            job, on_done, on_error = self.jobs.get()
+            try:
+                self.results.put((on_done, job(), None))
+            except Exception as error:
+                self.results.put((on_error, None, error))
+            finally:
+                self.jobs.task_done()
+
+    def _poll(self):
+        """Call the callbacks of the jobs that have finished since the last poll"""
+        while True:
+            try:
+                callback, result, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending -= 1
+            if error is None:
+                if callback is not None:
+                    callback(result)
+            elif callback is not None:
+                callback(error)
+            else:
+                messagebox.showerror("Error", str(error))
+        if self.pending:
+            self.widget.after(self.poll_interval, self._poll)
+
+
 class SelectionPane(tk.Frame):
 
     def __init__(self, parent, **kw):
@@ -3611,8 +5964,88 @@ class TileAssembly(SelectionPane):
         super().__init__(parent, **kw)
 
 
+class LevelIndex:
+    """Spatial index of the levels in the world: each level's rectangle is filed under every bucket of a coarse grid
+    that it overlaps, so the levels in a region can be found without looking at all of them"""
+
+    # Width and height of a bucket, in world pixels
+    bucket_size = 512
+
+    def __init__(self):
+        self.buckets = {}
+        # {level name: (x0, y0, x1, y1)}
+        self.rects = {}
+        # Rectangle covering every level, kept up to date as levels are placed.  None if it has to be worked out again,
+        # which is only the case once a level on its edge has moved or been removed.
+        self._bounds = None
+
+    def _bucket_range(self, rect):
+        """Iterate over the buckets the rectangle (x0, y0, x1, y1) overlaps"""
+        size = self.bucket_size
+        for bx in range(rect[0] // size, (rect[2] - 1) // size + 1):
+            for by in range(rect[1] // size, (rect[3] - 1) // size + 1):
+                yield bx, by
+
+    def place(self, name, rect):
+        """File the level under its (new) rectangle"""
+        self.remove(name)
+        self.rects[name] = rect
+        for bucket in self._bucket_range(rect):
+            self.buckets.setdefault(bucket, set()).add(name)
+        if self._bounds is not None:
+            x0, y0, x1, y1 = self._bounds
+            self._bounds = min(x0, rect[0]), min(y0, rect[1]), max(x1, rect[2]), max(y1, rect[3])
+        elif len(self.rects) == 1:
+            self._bounds = rect
+
+    def remove(self, name):
+        """Take the level out of the index, if it is in it"""
+        rect = self.rects.pop(name, None)
+        if rect is not None:
+            for bucket in self._bucket_range(rect):
+                self.buckets[bucket].discard(name)
+                if not self.buckets[bucket]:
+                    del self.buckets[bucket]
+            # The bounds may shrink if the level was on their edge
+            if self._bounds is not None and any(map(eq, rect, self._bounds)):
+                self._bounds = None
+
+    def query(self, rect):
+        """Returns the names of the levels overlapping the rectangle (x0, y0, x1, y1)"""
+        result = set()
+        for bucket in self._bucket_range(rect):
+            for name in self.buckets.get(bucket, ()):
+                x0, y0, x1, y1 = self.rects[name]
+                if x0 < rect[2] and rect[0] < x1 and y0 < rect[3] and rect[1] < y1:
+                    result.add(name)
+        return result
+
+    def bounds(self):
+        """Returns the rectangle covering every level, or None if there are none"""
+        if not self.rects:
+            return None
+        if self._bounds is None:
+            x0, y0, x1, y1 = zip(*self.rects.values())
+            self._bounds = min(x0), min(y0), max(x1), max(y1)
+        return self._bounds
+
+
 class WorldEditorWindow(tk.Frame):
-    mini_maps = {}
+    # Minimaps of the levels in the project: {level name: PIL image}.  Use set_mini_map to replace one.
+    mini_images = {}
+    # Minimaps scaled down for each zoom level, made as they are needed: {(level name, zoom level): PhotoImage}
+    thumbnails = {}
+    # Zooming out halves the scale of the world each step, down to 1 / 2 ** max_zoom_level
+    max_zoom_level = 3
+    # Minimaps are loaded from mini/ by a pool of threads, as their levels come into view.  Until then, levels are
+    # shown as a placeholder.
+    loader = None
+    loader_threads = 4
+    placeholder = Image.new('RGBA', (16, 16), (128, 128, 128, 128))
+    # Milliseconds between checks for loaded minimaps
+    poll_interval = 50
+    # Milliseconds between updates of a level being dragged around.  The motion events in between are merged.
+    drag_interval = 16
     __initialized = False
 
     def __init__(self, parent, **kwargs):
@@ -3630,6 +6063,15 @@ class WorldEditorWindow(tk.Frame):
         self.canvas_width = 0
         self.canvas_height = 0
         self.drag_mode = False
+        self.zoom_level = 0
+        self.cull_pending = False
+        # Canvas coordinates the level being dragged is to be moved to, on the next apply_drag
+        self.drag_to = None
+        self.drag_pending = False
+        # Minimaps being loaded: {level name: Future}, and those of levels out of view still to be loaded
+        self.loading = {}
+        self.unrequested = []
+        self.polling = False
 
         self.canvas_frame = tk.Frame(self)
         self.canvas_frame.pack(fill=tk.BOTH, expand=1)
@@ -3643,6 +6085,11 @@ class WorldEditorWindow(tk.Frame):
         self.canvas.bind("<B1-Motion>", func=self.drag_canvas)
         self.canvas.bind("<ButtonRelease-1>", func=self.release_click)
         self.canvas.bind("<Control-s>", func=lambda event: App.save_project_data())
+        self.canvas.bind("<Configure>", func=lambda event: self.schedule_cull())
+        # Zoom with the mouse wheel
+        self.canvas.bind("<MouseWheel>", func=lambda event: self.zoom(event, -1 if event.delta > 0 else 1))
+        self.canvas.bind("<Button-4>", func=lambda event: self.zoom(event, -1))
+        self.canvas.bind("<Button-5>", func=lambda event: self.zoom(event, 1))
 
         # Add the scrollbars
         self.canvas_vbar = tk.Scrollbar(self.canvas_frame, orient=tk.VERTICAL, command=self.canvas.yview)
@@ -3652,8 +6099,8 @@ class WorldEditorWindow(tk.Frame):
         self.canvas_hbar.grid(row=1, column=0, sticky=tk.EW)
         self.canvas_hbar.activate("slider")
         self.canvas.config(scrollregion=self.canvas.bbox("all"),
-                           xscrollcommand=self.canvas_hbar.set,
-                           yscrollcommand=self.canvas_vbar.set)
+                           xscrollcommand=lambda *args: self.scrolled(self.canvas_hbar, *args),
+                           yscrollcommand=lambda *args: self.scrolled(self.canvas_vbar, *args))
         self.canvas.xview(tk.MOVETO, 0.0)
         self.canvas.yview(tk.MOVETO, 0.0)
 
@@ -3663,18 +6110,28 @@ class WorldEditorWindow(tk.Frame):
         # Load visible levels
         self.level_list = {}
         self.level_references = {}
+        # Canvas items of the levels currently drawn (those in view): {level name: item}
+        self.drawn = {}
+        self.index = LevelIndex()
         self.reload()
 
+    @property
+    def scale(self):
+        """Size of a world pixel on the canvas"""
+        return 1 / 2 ** self.zoom_level
+
     def event_to_coords(self, event):
         """Convert the coordinates given by an event to actual coordinates on the canvas"""
-        return int(self.canvas.xview()[0] * self.canvas_width + event.x), int(
-            self.canvas.yview()[0] * self.canvas_height + event.y)
+        return int(self.canvas.canvasx(event.x)), int(self.canvas.canvasy(event.y))
 
     def release_click(self, event=None):
         """Update the fact that nothing is selected"""
+        # Finish moving the level that was being dragged
+        self.apply_drag()
         self.selected_image = None
         self.drag_mode = False
         self.update_bounding_box()
+        self.schedule_cull()
 
     def click_canvas(self, event):
         """Event callback for when the canvas is clicked"""
@@ -3695,19 +6152,57 @@ class WorldEditorWindow(tk.Frame):
         self.selected_image = event.widget.find_withtag('current')[0]
 
     def move_event(self, event):
-        """Handle user clicking on one of the images on the canvas"""
-        # Determine which image is being interacted with
-        x, y = self.event_to_coords(event)
+        """Handle user dragging one of the images on the canvas.  The image follows the mouse once every drag_interval,
+        rather than on every motion event."""
+        self.drag_to = self.event_to_coords(event)
+        if not self.drag_pending:
+            self.drag_pending = True
+            self.after(self.drag_interval, self.apply_drag)
+
+    def apply_drag(self):
+        """Move the level being dragged to where the mouse was last seen"""
+        self.drag_pending = False
+        if self.drag_to is None or not self.selected_image:
+            return
+        x, y = self.drag_to
+        self.drag_to = None
 
-        # Move the image with the mouse
+        # Move the image with the mouse.  A pixel on the canvas is 2 ** zoom_level pixels of the world.
         self.canvas.move(self.selected_image, x - self.start_x, y - self.start_y)
-        self.level_list[self.level_references[self.selected_image]].world_pos[0] += x - self.start_x
-        self.level_list[self.level_references[self.selected_image]].world_pos[1] += y - self.start_y
+        level_name = self.level_references[self.selected_image]
+        self.level_list[level_name].world_pos[0] += (x - self.start_x) * 2 ** self.zoom_level
+        self.level_list[level_name].world_pos[1] += (y - self.start_y) * 2 ** self.zoom_level
+        self.index.place(level_name, self.level_rect(level_name))
+        App.mark_project_dirty("levels", level_name)
 
-        # Set the starting x and y for next call to move_event
+        # Set the starting x and y for the next apply_drag
         self.start_x = x
         self.start_y = y
 
+    def zoom(self, event, step):
+        """Zoom out (step 1) or in (step -1) by a factor of two, keeping the point under the mouse where it is"""
+        zoom_level = min(max(self.zoom_level + step, 0), self.max_zoom_level)
+        if zoom_level == self.zoom_level or self.selected_image:
+            return
+        world_x = self.canvas.canvasx(event.x) / self.scale
+        world_y = self.canvas.canvasy(event.y) / self.scale
+        self.zoom_level = zoom_level
+        self.redraw_canvas()
+        x0, y0, x1, y1 = self.bounding_box
+        self.canvas.xview(tk.MOVETO, (world_x * self.scale - event.x - x0) / (x1 - x0))
+        self.canvas.yview(tk.MOVETO, (world_y * self.scale - event.y - y0) / (y1 - y0))
+
+    def scrolled(self, scrollbar, *args):
+        """Scroll callback of the canvas: update the scrollbar, and the levels drawn to match the new view"""
+        scrollbar.set(*args)
+        self.schedule_cull()
+
+    def schedule_cull(self):
+        """Update which levels are drawn once the view has settled, rather than on every scroll event"""
+        if not self.cull_pending:
+            self.cull_pending = True
+            self.after_idle(self.cull)
+
     def reload(self):
         """The generic reloading function for the World Editor Window"""
         # Update registered levels
@@ -3716,9 +6211,11 @@ class WorldEditorWindow(tk.Frame):
 
     def update_bounding_box(self):
         """Update the bounding box/scroll region of the canvas"""
-        bounding_box = list(self.canvas.bbox("all"))
-        maximum = int(max(abs(i) for i in bounding_box) * 1.5)
+        bounds = self.index.bounds() or (0, 0, 0, 0)
+        maximum = int(max(abs(i) for i in bounds) * self.scale * 1.5) + 1
         bounding_box = (-maximum, -maximum, maximum, maximum)
+        if bounding_box == self.bounding_box:
+            return
         self.canvas.config(scrollregion=bounding_box)
         self.canvas_width = bounding_box[2] - bounding_box[0]
         self.canvas_height = bounding_box[3] - bounding_box[1]
@@ -3731,34 +6228,162 @@ class WorldEditorWindow(tk.Frame):
             if level_name not in self.level_list:
                 # Load any mini-level not already loaded
                 self.level_list[level_name] = WorldEditorLevel(level_name, level_data["world_pos"])
+        for level_name in list(self.level_list):
+            if level_name not in App.project_data["levels"]:
+                del self.level_list[level_name]
+
+        # The minimaps (and so the size of the levels) may have changed as well
+        self.index = LevelIndex()
+        for level_name in self.level_list:
+            self.index.place(level_name, self.level_rect(level_name))
+
+        # The minimaps of levels out of view are loaded as well, once those in view have been, so that the size of the
+        # world is known
+        self.unrequested = [i for i in self.level_list if i not in self.mini_images]
+        self.start_polling()
+
+    def level_rect(self, level_name):
+        """Returns the rectangle a level covers in the world.  Levels are centered on their world position."""
+        width, height = self.mini_image(level_name).size
+        x, y = self.level_list[level_name].world_pos
+        return x - width // 2, y - height // 2, x - width // 2 + width, y - height // 2 + height
 
     def redraw_canvas(self):
         """Redraw elements on the canvas"""
         self.canvas.delete('all')
         self.level_references = {}
-        for level_name, level_data in self.level_list.items():
-            level_reference = self.canvas.create_image(level_data.world_pos[0],
-                                                       level_data.world_pos[1],
-                                                       image=WorldEditorWindow.mini_maps[level_name],
-                                                       tag=level_name)
-            self.level_references[level_reference] = level_name
-            self.canvas.tag_bind(level_name, '<Button-1>', self.click_event)
-            self.canvas.tag_bind(level_name, '<B1-Motion>', self.move_event)
-
-        # Update the scroll region
+        self.drawn = {}
+
+        # Update the scroll region, then draw the levels in view
         self.update_bounding_box()
+        self.cull()
+
+    def cull(self):
+        """Draw the levels in view, and remove those that have gone out of view"""
+        self.cull_pending = False
+        scale = self.scale
+        # The view, in world pixels, with a margin of half a screen on every side so that scrolling a little does not
+        # show empty space
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        x0 = self.canvas.canvasx(0) - width // 2
+        y0 = self.canvas.canvasy(0) - height // 2
+        view = (int(x0 / scale), int(y0 / scale), int((x0 + width * 2) / scale) + 1,
+                int((y0 + height * 2) / scale) + 1)
+        visible = self.index.query(view)
+
+        for level_name in list(self.drawn):
+            # Leave the level being dragged alone
+            if level_name not in visible and self.drawn[level_name] != self.selected_image:
+                item = self.drawn.pop(level_name)
+                del self.level_references[item]
+                self.canvas.delete(item)
+
+        for level_name in visible:
+            self.request_mini_image(level_name)
+            if level_name not in self.drawn:
+                world_pos = self.level_list[level_name].world_pos
+                level_reference = self.canvas.create_image(world_pos[0] * scale, world_pos[1] * scale,
+                                                           image=self.thumbnail(level_name, self.zoom_level),
+                                                           tag=level_name)
+                self.level_references[level_reference] = level_name
+                self.drawn[level_name] = level_reference
+                self.canvas.tag_bind(level_name, '<Button-1>', self.click_event)
+                self.canvas.tag_bind(level_name, '<B1-Motion>', self.move_event)
+
+    def request_mini_image(self, level_name):
+        """Start loading the minimap of a level, unless it has been loaded (or is being loaded) already"""
+        if level_name in self.mini_images or level_name in self.loading:
+            return
+        self.loading[level_name] = self.loader.submit(self.load_mini_image, level_name)
+        self.start_polling()
+
+    @staticmethod
+    def load_mini_image(level_name):
+        """Read the minimap of a level from mini/.  Runs on the loader threads."""
+        try:
+            img = Image.open(f'mini/{level_name}.png')
+            img.load()
+        except FileNotFoundError:
+            img = Image.new('RGBA', (16, 16), 0)
+            print("File not found!")
+        return img
+
+    def start_polling(self):
+        """Check for loaded minimaps every poll_interval, for as long as there are any to be loaded"""
+        if not self.polling and (self.loading or self.unrequested):
+            self.polling = True
+            self.after(self.poll_interval, self.poll_mini_images)
+
+    def poll_mini_images(self):
+        """Show the minimaps that have finished loading, and set more of them loading once those in view are done"""
+        loaded = False
+        for level_name, future in list(self.loading.items()):
+            if not future.done():
+                continue
+            del self.loading[level_name]
+            try:
+                image = future.result()
+            except Exception as error:
+                print(f'Could not load the minimap of {level_name}: {error}')
+                image = Image.new('RGBA', (16, 16), 0)
+            # A minimap saved in the meantime is newer than the one that was read
+            if level_name not in self.mini_images:
+                self.set_mini_map(level_name, image)
+                if level_name in self.level_list:
+                    self.index.place(level_name, self.level_rect(level_name))
+                    if level_name in self.drawn:
+                        self.canvas.itemconfig(self.drawn[level_name],
+                                               image=self.thumbnail(level_name, self.zoom_level))
+                    loaded = True
+
+        if not self.loading:
+            for level_name in self.unrequested[:self.loader_threads]:
+                self.request_mini_image(level_name)
+            del self.unrequested[:self.loader_threads]
+        if loaded and not self.selected_image:
+            # Levels take up their actual size now, which may bring them into view or widen the world
+            self.update_bounding_box()
+            self.schedule_cull()
+
+        self.polling = False
+        self.start_polling()
+
+    @classmethod
+    def stop_loading(cls):
+        """Stop taking on minimap loads, without waiting for the ones under way"""
+        if cls.loader is not None:
+            cls.loader.shutdown(wait=False)
+
+    @classmethod
+    def mini_image(cls, level_name):
+        """Returns the minimap of a level, or the placeholder if it has not been loaded yet"""
+        return cls.mini_images.get(level_name, cls.placeholder)
+
+    @classmethod
+    def thumbnail(cls, level_name, zoom_level):
+        """Returns the minimap of a level as a PhotoImage, scaled down for the zoom level"""
+        if level_name not in cls.mini_images:
+            level_name = None
+        thumbnail = cls.thumbnails.get((level_name, zoom_level))
+        if thumbnail is None:
+            image = cls.mini_image(level_name)
+            if zoom_level:
+                image = image.reduce(2 ** zoom_level)
+            thumbnail = cls.thumbnails[level_name, zoom_level] = ImageTk.PhotoImage(image)
+        return thumbnail
+
+    @classmethod
+    def set_mini_map(cls, level_name, image):
+        """Replace the minimap of a level.  It is shown the next time the world editor is redrawn."""
+        cls.mini_images[level_name] = image
+        for zoom_level in range(cls.max_zoom_level + 1):
+            cls.thumbnails.pop((level_name, zoom_level), None)
 
     @classmethod
     def __initialize(cls):
         """Initialization"""
-        # Load all the minimaps in the project
-        for level_name, level_data in App.project_data["levels"].items():
-            try:
-                img = Image.open(f'mini/{level_name}.png')
-            except FileNotFoundError:
-                img = Image.new('RGBA', (16, 16), 0)
-                print("File not found!")
-            cls.mini_maps[level_name] = ImageTk.PhotoImage(img)
+        # The minimaps in the project are loaded as they are needed
+        cls.loader = ThreadPoolExecutor(max_workers=cls.loader_threads)
 
         cls.__initialized = True
 
@@ -4113,13 +6738,11 @@ class SpriteView(ttk.Frame):
                 elif result:
                     # User added level to project.json
                     App.project_data["sprites"][self.view_name] = {"path": ""}
+                    App.mark_project_dirty("sprites", self.view_name)
                 else:
                     # User excluded level from project.json
                     self.sprite.ignore_from_project = True
 
-        # Save the project data to project.json
-        App.save_project_data()
-
         # No file path has been set
         if file is None:
             file = filedialog.asksaveasfilename(filetypes=[('JSON File', '*.json')],
@@ -4138,7 +6761,12 @@ class SpriteView(ttk.Frame):
         if self.view_name in App.project_data["sprites"]:
             print(file)
             relative_path = file.replace((getcwd() + '/').replace('\\', '/'), '')
-            App.project_data["sprites"][self.view_name]["path"] = relative_path
+            if App.project_data["sprites"][self.view_name]["path"] != relative_path:
+                App.project_data["sprites"][self.view_name]["path"] = relative_path
+                App.mark_project_dirty("sprites", self.view_name)
+
+        # Save the project data to project.json
+        App.save_project_data()
 
         # Write json tag to file
         with open(file, mode="w") as f:
@@ -4244,24 +6872,15 @@ class Sprite:
 
     def jsonify(self):
         """Convert sprite data to a formatted json string"""
-        # Build the json string
-        result = json.dumps({"name": self.name,
-                             "world_data": self.world_data.__dict__,
-                             "focus": self.focus,
-                             "position": self.position.__dict__,
-                             "path_type": self.path_type,
-                             "path_delay": self.path_delay,
-                             "facing_type": self.facing_type,
-                             "animation": dict((i, j.__dict__) for i, j in self.animation.items()),
-                             "stats": self.stats.__dict__},
-                            indent=2)
-
-        # Format the json string using regular expressions
-        result = re.sub(r'\s+([0-9.\-]+),', r'\1, ', result)
-        result = re.sub(r'\s+([0-9.\-]+)\s+\]', r' \1]', result)
-        result = re.sub(r':([0-9.\-]+)', r': \1', result)
-
-        return result
+        return "".join(iter_json({"name": self.name,
+                                  "world_data": self.world_data.__dict__,
+                                  "focus": self.focus,
+                                  "position": self.position.__dict__,
+                                  "path_type": self.path_type,
+                                  "path_delay": self.path_delay,
+                                  "facing_type": self.facing_type,
+                                  "animation": dict((i, j.__dict__) for i, j in self.animation.items()),
+                                  "stats": self.stats.__dict__}))
 
 
 class NotesEditorWindow(tk.Frame):
@@ -4286,7 +6905,10 @@ class NotesEditorWindow(tk.Frame):
 
     def save_notes(self):
         """Save notes to project.json"""
-        App.project_data["notes"] = self.textbox.get('1.0', 'end-1c')
+        notes = self.textbox.get('1.0', 'end-1c')
+        if notes != App.project_data["notes"]:
+            App.project_data["notes"] = notes
+            App.mark_project_dirty("notes")
         App.save_project_data()
 
     def undo_edit(self):
@@ -4326,6 +6948,22 @@ class Config:
     canvas_bg: str = None
     active_bg: str = None
     icon_color: str = None
+    # Undo memory budgets, in bytes, for each open level and for all of them together
+    undo_memory_per_view: int = 64 * 1024 * 1024
+    undo_memory_total: int = 256 * 1024 * 1024
+    # Number of most recent undo steps kept uncompressed
+    undo_uncompressed_steps: int = 16
+    # zlib compression level (0-9) of the minimap PNGs written on save.  Lower levels encode faster, higher levels make
+    # smaller files.
+    minimap_compress_level: int = 1
+    # Store decomaps as a ColumnarDecomap rather than a Decomap.  Better suited to decoration-heavy levels.
+    columnar_decomap: bool = False
+    # Write level tilemaps run-length encoded, under "tilemap_rle".  Much smaller for levels with large uniform areas.
+    rle_tilemap: bool = False
+    # Level grids with more cells than this are stored in a ChunkedGrid rather than a Grid
+    sparse_threshold: int = 512 * 512
+    # Binary levels with more tiles than this have their tilemap mapped into memory rather than read (see MappedGrid)
+    mapped_threshold: int = 2048 * 2048
 
 
 configs = {"default": Config("Default", canvas_bg="white"),
@@ -4336,6 +6974,15 @@ config = configs["dark"]
 class App:
     # Forgive me, for I have used variables with excessive scope
     project_data = {}
+    # The project data is read from the first of these that exists, and saved back to the same file
+    project_files = ("project.json", "project.json.gz", "project.json.xz")
+    project_file = "project.json"
+    # Each section of the project data is kept formatted for project.json, and only formatted again once it has been
+    # marked dirty.  The entries of these sections are formatted (and marked dirty) one by one.
+    project_entry_sections = ("levels", "sprites")
+    project_fragments = {}
+    project_revision = 0
+    project_saved_revision = 0
 
     # Set up color schemes
 
@@ -4365,6 +7012,7 @@ class App:
 
     def switch_tab(self, value):
         """Updates the toolbar to match the current tab"""
+        self.tilemap_editor.publish_minimaps()  # Give the world editor a live preview of the levels being edited.
         self.world_editor.reload()  # Ensure the world editor is reloaded.
         self.sprite_editor.reload()  # Ensure the sprite editor is reloaded.
         self.menubar.forget()
@@ -4386,22 +7034,260 @@ class App:
 
     @classmethod
     def load_project_data(cls):
-        """Load the project data from project.json"""
-        with open("project.json", mode="r") as f:
+        """Load the project data from project.json, or a compressed project.json.gz or project.json.xz"""
+        for file in cls.project_files:
+            if path.exists(file):
+                App.project_file = file
+                break
+        with open_compressed(App.project_file) as f:
             App.project_data = json.load(f)
+        App.project_fragments = {}
+        App.project_saved_revision = App.project_revision
+
+    @classmethod
+    def mark_project_dirty(cls, section, entry=None):
+        """Record that a section of the project data (or one entry of it, such as a single level) has changed, so that
+        it is formatted again and written on the next save"""
+        cls.project_fragments.pop(section, None)
+        if entry is not None:
+            cls.project_fragments.pop((section, entry), None)
+        else:
+            for key in [i for i in cls.project_fragments if isinstance(i, tuple) and i[0] == section]:
+                del cls.project_fragments[key]
+        cls.project_revision += 1
+
+    @classmethod
+    def _project_fragment(cls, key, value, indent):
+        """Returns the cached project.json text of a section or entry, formatting it if it is not cached"""
+        text = cls.project_fragments.get(key)
+        if text is None:
+            if key in cls.project_entry_sections and isinstance(value, dict) and value and \
+                    all(isinstance(i, (dict, list, tuple)) for i in value.values()):
+                inner = indent + "  "
+                text = "{" + ",".join(inner + json_key(name) + ": " + cls._project_fragment((key, name), item, inner)
+                                      for name, item in value.items()) + indent + "}"
+            else:
+                text = "".join(iter_json(value, indent))
+            cls.project_fragments[key] = text
+        return text
 
     @classmethod
     def save_project_data(cls):
-        """Save the project data to project.json"""
-        with open("project.json", mode="w") as f:
-            project_data = json.dumps(cls.project_data, indent=2)
-            project_data = re.sub(r'\s+([0-9.\-]+),', r'\1, ', project_data)
-            project_data = re.sub(r'\s+([0-9.\-]+)\s+\]', r' \1]', project_data)
-            project_data = re.sub(r':([0-9.\-]+)', r': \1', project_data)
+        """Save the project data to the file it was loaded from, if it has changed since it was last saved"""
+        project_data = cls.dump_project_data()
+        if project_data is not None:
+            cls.write_project_data(*project_data)
+
+    @classmethod
+    def dump_project_data(cls):
+        """Returns (project.json text, revision) for the project data, or None if the project file is up to date.  Only
+        the sections marked dirty since the last call are formatted again."""
+        if cls.project_revision == cls.project_saved_revision:
+            return None
+        if not cls.project_data:
+            return "{}", cls.project_revision
+        parts = ["{"]
+        last = len(cls.project_data) - 1
+        for i, (key, value) in enumerate(cls.project_data.items()):
+            text = cls._project_fragment(key, value, "\n  ")
+            parts.append("\n  " + json_key(key) + ": " + text)
+            if i != last:
+                parts.append(", " if not isinstance(value, (dict, list, tuple)) and json_number(text) else ",")
+        parts.append("\n}")
+        return "".join(parts), cls.project_revision
+
+    @classmethod
+    def write_project_data(cls, project_data, revision):
+        """Write text from dump_project_data to the project file.  Safe to call from the save worker."""
+        with atomic_write(cls.project_file) as f:
             f.write(project_data)
+        cls.project_saved_revision = revision
+
+
+class PNGStream:
+    """Writes an RGBA PNG file a band of rows at a time, so that images too large to hold in memory can be written"""
+
+    def __init__(self, f, width, height, compress_level=6):
+        self.f = f
+        self.width = width
+        self.rows_left = height
+        self.compressor = zlib.compressobj(compress_level)
+        f.write(b"\x89PNG\r\n\x1a\n")
+        # 8 bits per channel, RGBA, no interlacing
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+
+    def _chunk(self, tag, data):
+        """Write a chunk of the file"""
+        self.f.write(struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data)))
+
+    def write(self, image):
+        """Append the rows of an RGBA image as wide as the PNG"""
+        if image.width != self.width or image.height > self.rows_left:
+            raise ValueError("Image does not fit the rest of the PNG")
+        stride = self.width * 4
+        data = image.tobytes()
+        # Every row starts with the number of its filter, 0 being none
+        compressed = self.compressor.compress(b"".join(b"\0" + data[i:i + stride] for i in range(0, len(data), stride)))
+        if compressed:
+            self._chunk(b"IDAT", compressed)
+        self.rows_left -= image.height
+
+    def close(self):
+        """Finish the PNG, once all of its rows have been written"""
+        if self.rows_left:
+            raise ValueError(f'{self.rows_left} rows of the PNG were not written')
+        self._chunk(b"IDAT", self.compressor.flush())
+        self._chunk(b"IEND", b"")
+
+
+def load_tile_images(size):
+    """Load the textures of the tiles and decos in ids.json, scaled to 'size' pixels square the way the editor does.
+    Unlike the editor's own loading, this does not need Tk.  Returns ({tile id: image}, {deco id: image})."""
+    with open("assets/ids.json", mode="r") as f:
+        file_data = json.load(f)
+    if not TilemapEditorWindow.ids_data:
+        # Levels from before format_version need the deco heights
+        for list_name, id_list in file_data.items():
+            TilemapEditorWindow.ids_data[list_name] = {i["id"]: i for i in id_list}
+    result = []
+    for list_name in ("tile_ids", "deco_ids"):
+        images = {}
+        for i in file_data[list_name]:
+            img = Image.open("tiles/" + i["tex"])
+            img = img.crop([0, 0, 16, 16])
+            images[int(i["id"])] = img.resize((size, size), Image.NEAREST)
+        result.append(images)
+    return tuple(result)
+
+
+def decos_by_row(level, selected_height=0):
+    """Returns the level's decos at the selected height (all of them, if 0) as {y: [deco,...]}, each row in the
+    order the minimap draws them in"""
+    decos = level.decomap.filter_height(selected_height)
+    decos.sort(key=minimap_order)
+    rows = {}
+    for deco in decos:
+        if deco.deco_id != 0:
+            rows.setdefault(deco.y, []).append(deco)
+    return rows
+
+
+def render_level_rows(level, row0, row1, tile_images, deco_images, deco_rows, size):
+    """Render rows row0 to row1 of a level like render_minimap does, but with tiles 'size' pixels square.  deco_rows
+    comes from decos_by_row."""
+    image = Image.new('RGBA', (size * level.level_width, size * (row1 - row0)))
+    for x, y, tile_id in level.tilemap.iter_cells((0, row0, level.level_width, row1)):
+        paste_mini_img(image, tile_images[tile_id], x, y - row0, size)
+    for y in range(row0, row1):
+        for deco in deco_rows.get(y, ()):
+            paste_mini_img(image, deco_images[deco.deco_id], deco.x, y - row0, size)
+    return image
+
+
+def export_world(destination, tile_size=8, strip_height=256):
+    """Render every level in the project at its world position into one PNG, tiles being tile_size pixels square (8
+    is the scale of the minimaps and world editor, 64 that of the tilemap editor).  Levels drawn later in the project
+    go on top.  The image is put together and written strip_height rows at a time, and each level is only kept loaded
+    while the strips pass over it, so the memory needed does not depend on the height of the world.  Returns the number
+    of levels drawn."""
+    tile_images, deco_images = load_tile_images(tile_size)
+
+    # Find where every level lies in the world (in minimap pixels, the unit of world_pos)
+    index = LevelIndex()
+    files = {}
+    for level_name, level_data in App.project_data["levels"].items():
+        if not level_data["path"]:
+            print(f'Skipping {level_name}, it has no level file')
+            continue
+        level = Level()
+        try:
+            level.load_from_file(level_data["path"])
+        except (OSError, ValueError) as error:
+            print(f'Skipping {level_name}, its level file could not be loaded: {error}')
+            continue
+        x, y = level_data["world_pos"]
+        width, height = level.level_width * 8, level.level_height * 8
+        index.place(level_name, (x - width // 2, y - height // 2, x - width // 2 + width, y - height // 2 + height))
+        files[level_name] = level_data["path"]
+    bounds = index.bounds()
+    if bounds is None:
+        raise ValueError("There are no levels to export")
+    order = {level_name: i for i, level_name in enumerate(files)}
+    width = (bounds[2] - bounds[0]) * tile_size // 8
+    height = (bounds[3] - bounds[1]) * tile_size // 8
+
+    # {level name: (level, decos by row)} for the levels the current strip passes over, or None for those that could
+    # not be loaded again
+    loaded = {}
+    with atomic_write(destination, mode="wb") as f:
+        png = PNGStream(f, width, height, config.minimap_compress_level)
+        for top in range(0, height, strip_height):
+            bottom = min(top + strip_height, height)
+            strip = Image.new('RGBA', (width, bottom - top))
+            region = (bounds[0], bounds[1] + top * 8 // tile_size, bounds[2], bounds[1] - (-bottom * 8 // tile_size))
+            level_names = sorted(index.query(region), key=order.get)
+
+            # Strips go from top to bottom, so a level the strip has left behind is not needed again
+            for level_name in [i for i in loaded if i not in level_names]:
+                del loaded[level_name]
+            for level_name in level_names:
+                if level_name not in loaded:
+                    level = Level()
+                    try:
+                        level.load_from_file(files[level_name])
+                    except (OSError, ValueError) as error:
+                        # The file changed since it was measured
+                        print(f'Skipping the rest of {level_name}, its level file could not be loaded: {error}')
+                        loaded[level_name] = None
+                    else:
+                        loaded[level_name] = level, decos_by_row(level)
+                if loaded[level_name] is None:
+                    continue
+                level, deco_rows = loaded[level_name]
+                x0 = (index.rects[level_name][0] - bounds[0]) * tile_size // 8
+                y0 = (index.rects[level_name][1] - bounds[1]) * tile_size // 8
+                row0 = max((top - y0) // tile_size, 0)
+                row1 = min(-(-(bottom - y0) // tile_size), level.level_height)
+                if row0 >= row1:
+                    continue
+                rows = render_level_rows(level, row0, row1, tile_images, deco_images, deco_rows, tile_size)
+                offset = y0 + row0 * tile_size - top
+                strip.alpha_composite(rows, dest=(x0, max(offset, 0)), source=(0, max(-offset, 0)))
+            png.write(strip)
+        png.close()
+    return len(files)
+
+
+def convert_level(source, destination):
+    """Convert a level file to another format, as given by the file extensions.  Returns whether it succeeded."""
+    level = Level()
+    try:
+        level.load_from_file(source)
+    except (OSError, ValueError) as error:
+        print(f'Could not load {source}: {error}')
+        return False
+    level.save_to_file(destination)
+    return True
 
 
 def main():
+    # Command line level conversion: --convert SOURCE DESTINATION
+    if len(argv) == 4 and argv[1] == "--convert":
+        if any(path.exists(i) for i in App.project_files):
+            App.load_project_data()
+        else:
+            App.project_data = {"levels": {}}
+        if not convert_level(argv[2], argv[3]):
+            raise SystemExit(1)
+        return
+
+    # Command line world export: --export-world DESTINATION [TILE SIZE]
+    if len(argv) in (3, 4) and argv[1] == "--export-world":
+        App.load_project_data()
+        exported = export_world(argv[2], int(argv[3]) if len(argv) == 4 else 8)
+        print(f'Exported {exported} levels to {argv[2]}')
+        return
+
     root = tk.Tk()
     root.title("World Builder 2")
     icon = tk.PhotoImage("img_icon", data='''R0lGODlhEAAQAKU7ABIaVhIbVxckXhgkXh0rZR0sZSEybCU3ciU4cik9eCxBfS5
@@ -4423,6 +7309,9 @@ def main():
 
     main_app = App(root)
     root.mainloop()
+    WorldEditorWindow.stop_loading()
+    BackgroundWorker.wait_all()
+    Journal.shutdown()
 
 
 if __name__ == "__main__":
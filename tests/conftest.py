@@ -0,0 +1,26 @@
+import importlib.util
+import sys
+from os import path
+
+import pytest
+
+root = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def wb():
+    """The editor module, loaded from "World Builder 2.py" (whose name cannot be imported directly)"""
+    pytest.importorskip("tkinter")
+    pytest.importorskip("PIL")
+    spec = importlib.util.spec_from_file_location("world_builder", path.join(root, "World Builder 2.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(autouse=True)
+def project(wb, monkeypatch):
+    """An empty project, so that levels keep the world positions from their own files"""
+    monkeypatch.setattr(wb.App, "project_data", {"levels": {}})
+    return wb.App.project_data
@@ -0,0 +1,218 @@
+import gc
+
+import pytest
+
+
+@pytest.fixture
+def level(wb):
+    return wb.Level()
+
+
+@pytest.fixture
+def history(wb, level):
+    result = wb.EditHistory()
+    result.attach(level)
+    return result
+
+
+@pytest.fixture
+def budgets(wb, monkeypatch):
+    """Budgets that never drop or compress anything, for the tests to lower as needed"""
+    monkeypatch.setattr(wb.config, "undo_memory_per_view", 1 << 30)
+    monkeypatch.setattr(wb.config, "undo_memory_total", 1 << 30)
+    monkeypatch.setattr(wb.config, "undo_uncompressed_steps", 1 << 30)
+    # Histories left over from other tests count towards the global budget
+    gc.collect()
+    return wb.config
+
+
+def edit(history, level, x, y, value):
+    """Set a single tile as a transaction of its own"""
+    history.begin()
+    level.tilemap[x, y] = value
+    return history.commit()
+
+
+def test_undo_redo_cell_edit(history, level):
+    assert not history.undo()
+    history.begin()
+    level.tilemap[3, 4] = 7
+    level.tilemap[3, 4] = 8
+    level.tilemap[5, 6] = 1
+    assert history.commit()
+    # Repeated edits to the same tile are merged into one change
+    assert len(history.past) == 1 and len(history.past[0][2]) == 2
+
+    assert history.undo()
+    assert (level.tilemap[3, 4], level.tilemap[5, 6]) == (0, 0)
+    assert not history.undo()
+    assert history.redo()
+    assert (level.tilemap[3, 4], level.tilemap[5, 6]) == (8, 1)
+    assert not history.redo()
+
+
+def test_commit_without_net_change(history, level):
+    history.begin()
+    level.tilemap[3, 4] = 7
+    level.tilemap[3, 4] = 0
+    assert not history.commit()
+    assert not history.past
+
+
+def test_new_edit_clears_redo(history, level):
+    edit(history, level, 1, 1, 1)
+    edit(history, level, 2, 2, 2)
+    history.undo()
+    edit(history, level, 3, 3, 3)
+    assert not history.redo()
+    assert (level.tilemap[1, 1], level.tilemap[2, 2], level.tilemap[3, 3]) == (1, 0, 3)
+
+
+def test_undo_redo_resize(history, level):
+    width, height = level.level_width, level.level_height
+    history.begin()
+    level.change_size(right=2, down=1)
+    assert history.commit()
+    edit(history, level, width + 1, height, 3)
+    # Shrinking back clears the tile first, as part of the same step
+    history.begin()
+    level.change_size(right=-2, down=-1)
+    assert history.commit()
+    assert (level.level_width, level.level_height) == (width, height)
+    assert (level.collider.width, level.collider.height) == (width * 2, height * 2)
+
+    assert history.undo()
+    assert (level.level_width, level.level_height) == (width + 2, height + 1)
+    assert level.tilemap[width + 1, height] == 3
+    assert history.undo()
+    assert level.tilemap[width + 1, height] == 0
+    assert history.undo()
+    assert (level.level_width, level.level_height) == (width, height)
+    assert (level.collider.width, level.collider.height) == (width * 2, height * 2)
+
+    assert history.redo() and history.redo()
+    assert level.tilemap[width + 1, height] == 3
+    assert history.redo()
+    assert (level.level_width, level.level_height) == (width, height)
+
+
+def test_edits_across_resize_epochs(history, level):
+    # The same coordinates before and after a resize are different tiles, so their edits must not be merged
+    history.begin()
+    level.tilemap[5, 5] = 1
+    level.change_size(left=2)
+    level.tilemap[5, 5] = 2
+    assert history.commit()
+    assert level.tilemap[7, 5] == 1
+
+    assert history.undo()
+    assert level.level_width == 18
+    assert level.tilemap[5, 5] == 0 and not any(i for row in level.tilemap.rows() for i in row)
+    assert history.redo()
+    assert level.level_width == 20
+    assert (level.tilemap[5, 5], level.tilemap[7, 5]) == (2, 1)
+
+
+def test_compress_round_trip(wb, budgets, history, level):
+    history.begin()
+    level.tilemap[3, 4] = 7
+    level.decomap.add(12, 3, 4, 1, 2)
+    level.loading_zones[2, 2] = wb.LoadingZone("other", [4, 5])
+    level.height_zones[6, 6, 0] = wb.HeightZone(3, 1)
+    level.default_start = [1, 2]
+    changes = list(history.current.values())
+    assert history.commit()
+
+    decoded = history._decompress(history._compress(changes))
+    assert len(decoded) == len(changes)
+    for change, decoded_change in zip(changes, decoded):
+        assert decoded_change[0] is change[0]
+        assert decoded_change[1:] == change[1:]
+
+
+def test_compress_refuses_containers(history, level):
+    history.begin()
+    level.decomap = level.new_decomap()
+    changes = list(history.current.values())
+    assert history._compress(changes) is None
+    # Such steps are kept uncompressed, and can still be undone
+    assert history.commit()
+    history._compress_cold()
+    assert history.undo()
+
+
+def test_undo_redo_compressed_steps(wb, budgets, history, level):
+    budgets.undo_uncompressed_steps = 1
+    for i in range(1, 6):
+        edit(history, level, i, i, i)
+    assert [isinstance(data, bytes) for number, size, data in history.past] == [True] * 4 + [False]
+    memory = history.memory
+    assert memory == sum(size for number, size, data in history.past)
+
+    for i in range(5):
+        assert history.undo()
+    assert not any(i for row in level.tilemap.rows() for i in row)
+    for i in range(5):
+        assert history.redo()
+    assert [level.tilemap[i, i] for i in range(1, 6)] == [1, 2, 3, 4, 5]
+    assert history.memory == memory
+
+
+def test_per_view_budget(wb, budgets, history, level):
+    budgets.undo_memory_per_view = 5 * wb.EditHistory.change_size
+    for i in range(1, 11):
+        edit(history, level, i, 1, i)
+    assert len(history.past) == 5 and history.memory <= budgets.undo_memory_per_view
+
+    # Only the newest steps are left to undo, the older edits stay put
+    for i in range(5):
+        assert history.undo()
+    assert not history.undo()
+    assert [level.tilemap[i, 1] for i in range(1, 11)] == [1, 2, 3, 4, 5, 0, 0, 0, 0, 0]
+
+
+def test_per_view_budget_keeps_last_step(wb, budgets, history, level):
+    budgets.undo_memory_per_view = 1
+    history.begin()
+    for i in range(10):
+        level.tilemap[i, 0] = 1
+    history.commit()
+    assert len(history.past) == 1
+    assert history.undo()
+    assert not any(level.tilemap[i, 0] for i in range(10))
+
+
+def test_total_budget(wb, budgets, level):
+    budgets.undo_memory_total = 5 * wb.EditHistory.change_size
+    other_level = wb.Level()
+    first, second = wb.EditHistory(), wb.EditHistory()
+    first.attach(level)
+    second.attach(other_level)
+
+    for i in range(1, 4):
+        edit(first, level, i, 1, i)
+        edit(second, other_level, i, 1, i)
+    # The oldest step overall goes first, whichever history it belongs to
+    assert (len(first.past), len(second.past)) == (2, 3)
+    assert first.memory + second.memory <= budgets.undo_memory_total
+
+    edit(first, level, 4, 1, 4)
+    assert (len(first.past), len(second.past)) == (3, 2)
+    assert first.memory + second.memory <= budgets.undo_memory_total
+
+
+def test_total_budget_redo_steps(wb, budgets, level):
+    # A history with nothing left to undo gives up its furthest redo steps instead
+    other_level = wb.Level()
+    first, second = wb.EditHistory(), wb.EditHistory()
+    first.attach(level)
+    second.attach(other_level)
+    for i in range(1, 4):
+        edit(first, level, i, 1, i)
+    for i in range(3):
+        first.undo()
+    budgets.undo_memory_total = 3 * wb.EditHistory.change_size
+    edit(second, other_level, 1, 1, 1)
+    assert (len(first.future), len(second.past)) == (2, 1)
+    assert first.redo() and first.redo() and not first.redo()
+    assert [level.tilemap[i, 1] for i in range(1, 4)] == [1, 2, 0]
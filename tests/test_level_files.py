@@ -0,0 +1,39 @@
+import glob
+from os import path
+
+import pytest
+
+root = path.dirname(path.dirname(path.abspath(__file__)))
+maps = sorted(glob.glob(path.join(root, "maps", "*.json")))
+
+
+def load(wb, file):
+    level = wb.Level()
+    level.load_from_file(file, warn=lambda message: None)
+    return level
+
+
+@pytest.mark.parametrize("extension", [".wbl", ".wbl.gz", ".json.xz"])
+@pytest.mark.parametrize("map_file", maps, ids=path.basename)
+def test_round_trip(wb, tmp_path, map_file, extension):
+    level = load(wb, map_file)
+    file = str(tmp_path / ("level" + extension))
+    level.save_to_file(file)
+    assert load(wb, file) == level
+
+
+@pytest.mark.parametrize("mapped", [False, True], ids=["read", "mapped"])
+def test_truncated_binary(wb, tmp_path, monkeypatch, mapped):
+    if mapped:
+        monkeypatch.setattr(wb.config, "mapped_threshold", 0)
+    file = str(tmp_path / "level.wbl")
+    load(wb, path.join(root, "maps", "void.json")).save_to_file(file)
+    with open(file, "rb") as f:
+        data = f.read()
+
+    for length in range(len(data)):
+        truncated = str(tmp_path / f"truncated{length}.wbl")
+        with open(truncated, "wb") as f:
+            f.write(data[:length])
+        with pytest.raises(ValueError):
+            load(wb, truncated)